@@ -3,11 +3,13 @@ import json
 import os
 import yaml
 import numpy as np
+import torch
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 
 from numpyencoder import NumpyEncoder
 
 from src import run_fed_train, run_batch_train
-from src.training_pipelines import *
 
 
 def _parse_args():
@@ -38,6 +40,21 @@ def _parse_args():
                         type=int,
                         default=1,
                         help='Specify number of repeat runs')
+    parser.add_argument('--checkpoint_dir',
+                        type=str,
+                        default=None,
+                        help='Checkpoint every checkpoint_freq epochs into this dir')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Continue from the latest checkpoint in the checkpoint dir')
+    parser.add_argument('--parallel_seeds',
+                        type=int,
+                        default=1,
+                        help='Run these many of the repeat runs (seeds) in parallel processes')
+    parser.add_argument('--threads_per_seed',
+                        type=int,
+                        default=None,
+                        help='torch threads of each parallel run (default: cores / parallel_seeds)')
     args = parser.parse_args()
     return args
 
@@ -53,9 +70,14 @@ def init_metric(config):
                "train_error": [],
                "train_loss": [],
                "train_acc": [],
+               # CI half width of the sampled (eval_config.sample_budget) accuracy estimates - 0 for full passes
+               "train_acc_ci": [],
+               "test_acc_ci": [],
 
                "communication_residual": [],
                "sparse_approx_residual": [],
+               # relative error of storing G in grad_storage_dtype (once per epoch)
+               "grad_storage_rel_error": [],
                # # Grad Matrix Stats
                # "frac_mass_retained": [],
                # "grad_norm_dist": [],
@@ -68,7 +90,11 @@ def init_metric(config):
                "epoch_sparse_approx_cost": [],
                "epoch_grad_cost": [],
                "epoch_agg_cost": [],
+               # GB/s of the GAR counting one pass over G per aggregation / per GM iteration
+               "epoch_agg_gbps": [],
                "epoch_gm_iter": [],
+               "epoch_pipeline_wait_cost": [],
+               "epoch_train_time": [],
 
                # Total Costs
                "total_cost": 0,
@@ -77,47 +103,81 @@ def init_metric(config):
                "total_sparse_cost": 0,
 
                "total_gm_iter": 0,
+               # (estimated) savings of warm starting GM (geo_med_config.warm_start)
+               "total_gm_iter_saved": 0,
+               "total_gm_time_saved": 0,
                "avg_gm_cost": 0,
 
                "num_iter": 0,
                "num_steps": 0,
+
+               # per stage perf_counter_ns span stats (trace_config.enabled)
+               "trace_summary": {},
                }
     return metrics
 
 
+def get_trainer(pipeline: str, train_mode: str):
+    """ returns the training function of the train mode """
+    if pipeline != 'sampling':
+        raise NotImplementedError
+    if train_mode == 'fed':
+        return run_fed_train
+    elif train_mode == 'distributed':
+        return run_batch_train
+    else:
+        raise NotImplementedError
+
+
+def _run_seed(pipeline: str, train_mode: str, config, seed, num_threads=None):
+    """ Runs training for one seed and returns its metrics (module level so that it can run in a worker process) """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    trainer = get_trainer(pipeline=pipeline, train_mode=train_mode)
+    metrics = init_metric(config=config)
+
+    # Launch Federated / Regular / Distributed Training
+    trainer(config=config, metrics=metrics, seed=seed)
+    return metrics
+
+
 def run_main():
     args = _parse_args()
     print(args)
     root = os.getcwd()
 
     pipeline = args.pipeline
-
-    if pipeline == 'sampling':
-        trainer = SamplingPipeline()
-    else:
-        raise NotImplementedError
+    train_mode = args.train_mode
+    # fail fast on unknown pipelines / train modes
+    get_trainer(pipeline=pipeline, train_mode=train_mode)
 
     config_path = args.conf if args.conf else root + '/configs/default_config.yaml'
     config = yaml.load(open(config_path), Loader=yaml.FullLoader)
 
+    if (args.checkpoint_dir or args.resume) and train_mode == 'fed':
+        raise ValueError('--checkpoint_dir / --resume are only supported with --train_mode distributed')
+    checkpoint_config = config["training_config"].setdefault("checkpoint_config", {})
+    if args.checkpoint_dir:
+        checkpoint_config["checkpoint_dir"] = args.checkpoint_dir
+    if args.resume:
+        if checkpoint_config.get("checkpoint_dir", None) is None:
+            raise ValueError('--resume needs a checkpoint dir')
+        checkpoint_config["resume"] = True
+
     # Training - Repeat over the random seeds #
     # ----------------------------------------
-    results = []
-
-    for seed in np.arange(args.n_repeat):
-        train_mode = args.train_mode
-        metrics = init_metric(config=config)
-
-        # Launch Federated Training
-        if train_mode == 'fed':
-            trainer.run_fed_train(config=config, metrics=metrics, seed=seed)
-            results.append(metrics)
-        # Launch Regular / Distributed Training
-        elif train_mode == 'distributed':
-            trainer.run_batch_train(config=config, metrics=metrics, seed=seed)
-            results.append(metrics)
-        else:
-            raise NotImplementedError
+    seeds = np.arange(args.n_repeat)
+
+    if args.parallel_seeds > 1:
+        # limit torch threads per run so that the parallel runs do not oversubscribe the cores
+        num_threads = args.threads_per_seed or max(1, os.cpu_count() // args.parallel_seeds)
+        with ProcessPoolExecutor(max_workers=args.parallel_seeds, mp_context=mp.get_context('spawn')) as executor:
+            futures = [executor.submit(_run_seed, pipeline, train_mode, config, seed, num_threads) for seed in seeds]
+            # results in seed order
+            results = [future.result() for future in futures]
+    else:
+        results = [_run_seed(pipeline=pipeline, train_mode=train_mode, config=config, seed=seed,
+                             num_threads=args.threads_per_seed) for seed in seeds]
 
     # Write Results
     # ----------------
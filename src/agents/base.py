@@ -1,6 +1,10 @@
+from src.trace_manager import NULL_TRACER
+
+
 class Agent:
     def __init__(self):
-        pass
+        # perf_counter_ns spans of the agent steps (no-op unless a Tracer is set)
+        self.tracer = NULL_TRACER
 
     def train_step(self,
                    num_steps=1,
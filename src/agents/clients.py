@@ -7,6 +7,7 @@ from src.model_manager import (flatten_params,
                                flatten_grads, )
 import copy
 from src.compression_manager import C
+from src.trace_manager import traced
 
 
 class FedClient(Agent):
@@ -51,6 +52,7 @@ class FedClient(Agent):
         self.w_current = w_current
         self.w_old = w_old
 
+    @traced('client_train_step')
     def train_step(self, num_steps=1, device="cpu"):  # -> float:
         dist_weights_to_model(self.w_current, learner=self.learner)
         for it in range(num_steps):
@@ -71,9 +73,11 @@ class FedClient(Agent):
         updated_model_weights = flatten_params(learner=self.learner)
         self.grad_current = self.w_current - updated_model_weights
         if self.C:
-            self.grad_current = self.C.compress(g=self.grad_current, lr=self.optimizer.param_groups[0]['lr'])
-            self.w_current = self.C.compress(g=self.w_current, lr=self.optimizer.param_groups[0]['lr'])
+            with self.tracer.span('client_compression'):
+                self.grad_current = self.C.compress(g=self.grad_current, lr=self.optimizer.param_groups[0]['lr'])
+                self.w_current = self.C.compress(g=self.w_current, lr=self.optimizer.param_groups[0]['lr'])
 
+    @traced('client_train_step_mime')
     def train_step_mime(self, client_drift, server_momentum,
                         num_steps=1, device="cpu"):
 
@@ -105,6 +109,7 @@ class FedClient(Agent):
         g = flatten_grads(learner=self.learner)  # extract grad
         return g
 
+    @traced('client_train_step_glomo')
     def train_step_glomo(self, num_steps=1, device="cpu"):
         if self.learner_stale is None:
             self.learner_stale = copy.deepcopy(self.learner)
@@ -7,6 +7,7 @@ import numpy as np
 from typing import List
 from .clients import FedClient
 import copy
+from src.trace_manager import traced
 
 
 class FedServer(Agent):
@@ -18,7 +19,8 @@ class FedServer(Agent):
                  server_lrs,
                  gar: GAR,
                  gar_config,
-                 C=None):
+                 C=None,
+                 grad_attack_model=None):
         Agent.__init__(self)
         self.learner = server_model
         self.optimizer = server_optimizer
@@ -27,6 +29,8 @@ class FedServer(Agent):
         self.gar_config = gar_config
 
         self.C = C
+        # byzantine attack applied on the stacked client grads (G) before aggregation
+        self.grad_attack_model = grad_attack_model
 
         self.G = None
         self.G_stale = None
@@ -42,6 +46,7 @@ class FedServer(Agent):
         self.beta = 1
         self.c = self.gar_config.get('glomo_server_c', 1)
 
+    @traced('server_update_step')
     def update_step(self):
         # update server model
         self.optimizer.zero_grad()
@@ -54,6 +59,7 @@ class FedServer(Agent):
         self.w_old = self.w_current
         self.w_current = flatten_params(learner=self.learner)
 
+    @traced('server_agg_grad')
     def compute_agg_grad(self, clients: List[FedClient]):
         # Now update server model
         # stack grads - compute G
@@ -66,9 +72,19 @@ class FedServer(Agent):
                 self.G = np.ndarray((n, d), dtype=g_i.dtype)
             self.G[ix, :] = g_i
 
+        self.attack_grads()
+
         # invoke gar and get aggregate
-        self.u = self.gar.aggregate(G=self.G, )
+        with self.tracer.span('gar'):
+            self.u = self.gar.aggregate(G=self.G, )
+
+    def attack_grads(self):
+        """ corrupts the rows of G in place """
+        if self.grad_attack_model is not None:
+            with self.tracer.span('grad_attack'):
+                self.G = self.grad_attack_model.launch_attack(G=self.G)
 
+    @traced('server_agg_grad_delicoco')
     def compute_agg_grad_delicoco(self, clients: List[FedClient]):
         n = len(clients)
         self.w_old = self.w_current
@@ -80,6 +96,7 @@ class FedServer(Agent):
 
         dist_weights_to_model(weights=self.w_old + self.C.compress(self.w_current - self.w_old), learner=self.learner)
 
+    @traced('server_agg_grad_mime')
     def compute_agg_grad_mime(self, clients: List[FedClient]):
         n = len(clients)
         self.client_drift = np.zeros_like(clients[0].glomo_grad)
@@ -95,6 +112,7 @@ class FedServer(Agent):
         self.mime_momentum = (1 - self.c) * self.client_drift + self.c * self.mime_momentum
         dist_weights_to_model(weights=self.w_current, learner=self.learner)
 
+    @traced('server_agg_grad_glomo')
     def compute_agg_grad_glomo(self, clients: List[FedClient]):
         """ Implements Das et.al. FedGlomo: server update step with (Glo)bal (Mo)mentum"""
         n = len(clients)
@@ -110,9 +128,12 @@ class FedServer(Agent):
             self.G[ix, :] = g_i
             self.G_stale[ix, :] = g_i_glomo
 
+        self.attack_grads()
+
         # invoke gar and get aggregate
-        agg_g = self.gar.aggregate(G=self.G)
-        agg_g_glomo = self.gar.aggregate(G=self.G_stale)
+        with self.tracer.span('gar'):
+            agg_g = self.gar.aggregate(G=self.G)
+            agg_g_glomo = self.gar.aggregate(G=self.G_stale)
 
         if self.u is None:
             self.u = agg_g
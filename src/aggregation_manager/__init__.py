@@ -1,2 +1,3 @@
 from .base import *
 from .gar_helper import *
+from .grad_matrix import *
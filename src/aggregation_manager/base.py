@@ -20,6 +20,9 @@ class GAR:
         self.current_losses = []
         self.agg_time = 0
         self.num_iter = 0  # usually if SUb routine has iters ex - GM
+        self.iter_saved = 0  # (estimated) iters saved by warm starting the sub routine
+        self.lr = None  # current learning rate - set by the trainer before aggregating
+        self._gather_buffer = None  # reused to gather the columns G[:, ix]
 
     def aggregate(self, G: np.ndarray, ix: List[int] = None) -> np.ndarray:
         """
@@ -28,7 +31,33 @@ class GAR:
         """
         raise NotImplementedError
 
+    def get_state(self):
+        """ returns (state, arrays) the GAR keeps across rounds - to be checkpointed """
+        return {}, {}
+
+    def set_state(self, state: Dict, arrays: Dict):
+        pass
+
+    def close(self):
+        """ releases what the GAR holds across rounds (ex. thread pools) - it can still be used afterwards """
+        pass
+
+    def gather_columns(self, G: np.ndarray, ix: List[int]) -> np.ndarray:
+        """
+        Returns G[:, ix] gathered into a buffer reused across rounds instead of a fresh copy each round.
+        Note: the result is only valid till the next call
+        """
+        ix = np.asarray(ix, dtype=np.intp)
+        # bounds are checked here since np.take(mode='raise') with out= gathers into a temporary copy first
+        if len(ix) > 0 and (ix.min() < 0 or ix.max() >= G.shape[1]):
+            raise IndexError('column indices out of range for G with {} columns'.format(G.shape[1]))
+        shape = (G.shape[0], len(ix))
+        if self._gather_buffer is None or self._gather_buffer.shape != shape or self._gather_buffer.dtype != G.dtype:
+            self._gather_buffer = np.empty(shape, dtype=G.dtype)
+        return np.take(G, ix, axis=1, out=self._gather_buffer, mode='clip')
+
     def block_descent_aggregate(self, sparse_approx_config: Dict, G: np.ndarray):
+        """ Note: the sparse approximation is done in place on G """
         sparse_rule = sparse_approx_config.get('rule', None)
         sparse_selection = SparseApproxMatrix(conf=sparse_approx_config) if sparse_rule in ['active_norm', 'random'] \
             else None
@@ -39,20 +68,48 @@ class GAR:
         return agg_g
 
     @staticmethod
-    def weighted_average(stacked_grad: np.ndarray, alphas=None):
+    def acc_dtype(G: np.ndarray):
+        """ dtype to accumulate and return aggregates in - reduced precision (float16) G is accumulated in float32 """
+        return np.promote_types(G.dtype, np.float32)
+
+    @staticmethod
+    def weighted_average(stacked_grad: np.ndarray, alphas=None, out: np.ndarray = None, chunk_size: int = None,
+                         buffer: np.ndarray = None):
         """
         Implements weighted average of grad vectors stacked along rows of G
         If no weights are supplied then its equivalent to simple average
+        Computed as a single GEMV (alphas @ G) accumulated in acc_dtype and written into out (allocated if None).
+        chunk_size: number of columns per GEMV (None : one GEMV) - reduced precision G is always chunked since it is
+        converted to acc_dtype chunk by chunk
+        buffer: (n x chunk_size) acc_dtype scratch for the conversion (allocated if None) - iterative callers pass
+        their own so that they do not allocate on every call
         """
         n, d = stacked_grad.shape  # n is treated as num grad vectors to aggregate, d is grad dim
+        acc_dtype = GAR.acc_dtype(stacked_grad)
         if alphas is None:
             # make alpha uniform
-            alphas = [1.0 / n] * n
+            alphas = np.full(n, 1.0 / n, dtype=acc_dtype)
         else:
             assert len(alphas) == n
+            alphas = np.asarray(alphas, dtype=acc_dtype)
 
-        agg_grad = np.zeros_like(stacked_grad[0, :])
+        if out is None:
+            out = np.empty(d, dtype=acc_dtype)
+        if chunk_size is None and stacked_grad.dtype != acc_dtype:
+            chunk_size = buffer.shape[1] if buffer is not None else 2 ** 14
+        if chunk_size is None:
+            np.matmul(alphas, stacked_grad, out=out)
+            return out
 
-        for ix in range(0, n):
-            agg_grad += alphas[ix] * stacked_grad[ix, :]
-        return agg_grad
+        # (mixed dtype matmul does not use BLAS : reduced precision chunks are first converted into a buffer,
+        # by torch since its half -> float conversion is vectorized)
+        convert = stacked_grad.dtype != acc_dtype
+        if convert and buffer is None:
+            buffer = np.empty((n, min(chunk_size, d)), dtype=acc_dtype)
+        for start in range(0, d, chunk_size):
+            block = stacked_grad[:, start:start + chunk_size]
+            if convert:
+                torch.from_numpy(buffer[:, :block.shape[1]]).copy_(torch.from_numpy(block))
+                block = buffer[:, :block.shape[1]]
+            np.matmul(alphas, block, out=out[start:start + chunk_size])
+        return out
@@ -0,0 +1,92 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .base import GAR
+
+"""
+Coordinate wise aggregation engine (median / trimmed mean).
+The d columns of G are split into cache sized blocks ; each block is copied transposed (block_size x n, so that
+the n values of a coordinate are contiguous) in the accumulation dtype, reduced with partition based selection
+(np.partition - O(n) per coordinate instead of a full sort) and written into a preallocated output. The blocks are processed by a thread pool (numpy releases the GIL while partitioning).
+"""
+
+
+class CoordinateWiseEngine:
+    def __init__(self, num_threads: int = None, block_size: int = None):
+        """
+        num_threads: size of the thread pool (None : number of cores)
+        block_size: number of columns per block (None : ~1MB worth of G rows)
+        """
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.block_size = block_size
+        self._pool = None
+
+    def median(self, G: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """ same as np.median(G, axis=0) - in GAR.acc_dtype(G) """
+        n = G.shape[0]
+        k = n // 2
+
+        def reduce(block, out_block):
+            # a single selection : for even n the lower middle value is the max of the left part
+            # (np.partition with several kth is ~3x slower)
+            block.partition(k, axis=1)
+            if n % 2 == 1:
+                out_block[:] = block[:, k]
+            else:
+                np.max(block[:, :k], axis=1, out=out_block)
+                out_block += block[:, k]
+                out_block /= 2
+
+        return self.run(G=G, reduce=reduce, out=out)
+
+    def trimmed_mean(self, G: np.ndarray, proportion: float, out: np.ndarray = None) -> np.ndarray:
+        """ same as scipy.stats.trim_mean(G, proportion, axis=0) - in GAR.acc_dtype(G) """
+        n = G.shape[0]
+        lower_cut = int(proportion * n)
+        upper_cut = n - lower_cut
+        if lower_cut > upper_cut:
+            raise ValueError("Proportion too big.")
+
+        def reduce(block, out_block):
+            if lower_cut > 0:
+                # nested single selections : upper cut, then lower cut within the left part
+                # (nothing left of the upper cut to select from when at most one value is kept)
+                block.partition(upper_cut - 1, axis=1)
+                if lower_cut < upper_cut - 1:
+                    block[:, :upper_cut - 1].partition(lower_cut, axis=1)
+            np.sum(block[:, lower_cut:upper_cut], axis=1, out=out_block)
+            out_block /= upper_cut - lower_cut
+
+        return self.run(G=G, reduce=reduce, out=out)
+
+    def run(self, G: np.ndarray, reduce, out: np.ndarray = None) -> np.ndarray:
+        """ out[cols] = reduce(copy of G[:, cols].T) over the column blocks """
+        n, d = G.shape
+        acc_dtype = GAR.acc_dtype(G)
+        if out is None:
+            out = np.empty(d, dtype=acc_dtype)
+        block_size = self.block_size or max(64, 2 ** 18 // n)
+
+        def reduce_block(start):
+            block = np.ascontiguousarray(G[:, start:start + block_size].T, dtype=acc_dtype)
+            reduce(block, out[start:start + block_size])
+
+        starts = range(0, d, block_size)
+        if self.num_threads == 1 or len(starts) == 1:
+            for start in starts:
+                reduce_block(start)
+        else:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.num_threads)
+            # list() re-raises the exceptions of the blocks (if any)
+            list(self._pool.map(reduce_block, starts))
+        return out
+
+    def close(self):
+        """ shuts the thread pool down (a new one is started if the engine is used again) """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,277 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import numpy as np
+from .base import GAR
+
+"""
+Allocation free kernels for the Geometric Median solvers (Weiszfeld / Vardi).
+Every iteration is two passes over X: the distances ||x_i - mu|| (one fused pass over column chunks through a
+cache sized buffer) and the weighted sum w @ X (a single GEMV). Everything is computed in GAR.acc_dtype(X)
+(float32 for float32 / float16 X) in buffers that are reused across iterations and rounds.
+"""
+
+
+class GMKernel:
+    def __init__(self, chunk_size: int = None):
+        """ chunk_size: number of columns per distance pass (None : ~1MB worth of X rows) """
+        self.chunk_size = chunk_size
+        self._shape = None
+        self._dtype = None
+
+    def prepare(self, X: np.ndarray):
+        """ (re)allocates the buffers if X changed shape / dtype """
+        n, d = X.shape
+        dtype = GAR.acc_dtype(X)
+        if self._shape == (n, d) and self._dtype == X.dtype:
+            return
+        self._shape, self._dtype = (n, d), X.dtype
+        chunk_size = self.chunk_size or max(256, 2 ** 18 // n)
+        self.diff = np.empty((n, min(chunk_size, d)), dtype=dtype)
+        self.partial = np.empty(n, dtype=dtype)
+        self.dist = np.empty(n, dtype=dtype)
+        self.w = np.empty(n, dtype=dtype)
+        self.mu = np.empty(d, dtype=dtype)
+        self.mu1 = np.empty(d, dtype=dtype)
+        self.step = np.empty(d, dtype=dtype)
+        # (accelerated weiszfeld)
+        self.y = np.empty(d, dtype=dtype)
+        self.mu_prev = np.empty(d, dtype=dtype)
+        # reduced precision X is converted to acc dtype chunk by chunk for the weighted sum
+        self.convert = np.empty((n, min(2 ** 14, d)), dtype=dtype) if X.dtype != dtype else None
+
+    def distances(self, X: np.ndarray, mu: np.ndarray, nu: float = 0) -> np.ndarray:
+        """ dist_i = ||x_i - mu|| ; smoothed : sqrt(||x_i - mu||^2 + nu^2) """
+        self.dist[:] = nu * nu
+        chunk_size = self.diff.shape[1]
+        for start in range(0, X.shape[1], chunk_size):
+            stop = min(start + chunk_size, X.shape[1])
+            diff = self.diff[:, :stop - start]
+            np.subtract(X[:, start:stop], mu[start:stop], out=diff)
+            np.einsum('ij,ij->i', diff, diff, out=self.partial)
+            self.dist += self.partial
+        return np.sqrt(self.dist, out=self.dist)
+
+    def weiszfeld_step(self, X: np.ndarray, mu: np.ndarray, out: np.ndarray, nu: float = 0) -> float:
+        """ out = weiszfeld map of mu (weights 1 / dist_i, rows at distance 0 get weight 1) ; returns sum_i dist_i """
+        distances = self.distances(X=X, mu=mu, nu=nu)
+        objective = float(distances.sum())
+        distances[distances == 0] = 1
+        w = np.divide(1, distances, out=self.w)
+        w /= w.sum()
+        self.weighted_sum(X=X, w=w, out=out)
+        return objective
+
+    def weighted_sum(self, X: np.ndarray, w: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """ out = w @ X """
+        return GAR.weighted_average(stacked_grad=X, alphas=w, out=out, buffer=self.convert)
+
+    def movement(self, mu: np.ndarray, mu1: np.ndarray) -> float:
+        """ ||mu - mu1|| """
+        np.subtract(mu, mu1, out=self.step)
+        return float(np.sqrt(np.dot(self.step, self.step)))
+
+    def init_mu(self, X: np.ndarray, init: np.ndarray = None) -> np.ndarray:
+        """ mu = init if supplied else mean(X) """
+        if init is not None:
+            np.copyto(self.mu, init)
+            return self.mu
+        self.w[:] = 1 / X.shape[0]
+        return self.weighted_sum(X=X, w=self.w, out=self.mu)
+
+
+def vardi(X: np.ndarray, eps: float, max_iter: int, init: np.ndarray = None, kernel: GMKernel = None):
+    """
+    Implementation of "The multivariate L1-median and associated data depth;
+    Yehuda Vardi and Cun-Hui Zhang; PNAS'2000"
+    returns gm (zeros if max_iter ran out), num_iter
+    """
+    kernel = kernel or GMKernel()
+    kernel.prepare(X)
+    n = X.shape[0]
+    mu, mu1 = kernel.init_mu(X=X, init=init), kernel.mu1
+    np.nan_to_num(mu, copy=False, nan=0, posinf=0, neginf=0)
+    num_iter = 1
+    while num_iter < max_iter:
+        D = kernel.distances(X=X, mu=mu)
+        non_zeros = D != 0
+        num_zeros = n - np.count_nonzero(non_zeros)
+        if num_zeros == n:
+            return mu.copy(), num_iter
+
+        # weights 1 / D_i normalized - the rows at distance 0 get weight 0
+        D_inv = kernel.w
+        D_inv[:] = 0
+        np.divide(1, D, out=D_inv, where=non_zeros)
+        sum_D_inv = D_inv.sum()
+        D_inv /= sum_D_inv
+        T = kernel.weighted_sum(X=X, w=D_inv, out=mu1)
+
+        if num_zeros > 0:
+            r = kernel.movement(mu=T, mu1=mu) * sum_D_inv
+            r_inv = 0 if r == 0 else num_zeros / r
+            T *= max(0, 1 - r_inv)
+            T += min(1, r_inv) * mu
+
+        np.nan_to_num(mu1, copy=False, nan=0, posinf=0, neginf=0)
+
+        if kernel.movement(mu=mu, mu1=mu1) < eps:
+            return mu.copy(), num_iter
+
+        mu, mu1 = mu1, mu
+        num_iter += 1
+
+    print('Ran out of Max iter for GM - returning all zero')
+    return np.zeros_like(mu), num_iter
+
+
+def weiszfeld(X: np.ndarray, eps: float, max_iter: int, init: np.ndarray = None, kernel: GMKernel = None):
+    """
+    Implements: On the point for which the sum of the distances to n given points is minimum
+    E Weiszfeld, F Plastria: Annals of Operations Research
+    returns gm, num_iter
+    """
+    kernel = kernel or GMKernel()
+    kernel.prepare(X)
+    mu, mu1 = kernel.init_mu(X=X, init=init), kernel.mu1
+    num_iter = 0
+    while num_iter < max_iter:
+        kernel.weiszfeld_step(X=X, mu=mu, out=mu1)
+        guess_movement = kernel.movement(mu=mu, mu1=mu1)
+
+        mu, mu1 = mu1, mu
+        if guess_movement <= eps:
+            return mu.copy(), num_iter
+        num_iter += 1
+
+    print('Ran out of Max iter for GM - returning sub optimal answer')
+    return mu.copy(), num_iter
+
+
+def accelerated_weiszfeld(X: np.ndarray, eps: float, max_iter: int, init: np.ndarray = None,
+                          kernel: GMKernel = None):
+    """
+    Weiszfeld (a majorize-minimize / scaled gradient step) with Nesterov extrapolation and gradient based
+    adaptive restart (O'Donoghue & Candes 2015) : the momentum is reset whenever the step from the extrapolated
+    point makes an obtuse angle with the last move. returns gm, num_iter
+    """
+    kernel = kernel or GMKernel()
+    kernel.prepare(X)
+    mu, mu_prev, mu1, y = kernel.init_mu(X=X, init=init), kernel.mu_prev, kernel.mu1, kernel.y
+    np.copyto(y, mu)
+    np.copyto(mu_prev, mu)
+    t = 1.
+    num_iter = 0
+    while num_iter < max_iter:
+        kernel.weiszfeld_step(X=X, mu=y, out=mu1)
+        # restart if (y - T(y)) . (T(y) - mu) > 0 ; (movement leaves T(y) - mu in step)
+        guess_movement = kernel.movement(mu=mu1, mu1=mu)
+        restart = np.dot(y, kernel.step) - np.dot(mu1, kernel.step) > 0 if t > 1 else False
+
+        mu_prev, mu, mu1 = mu, mu1, mu_prev
+        if guess_movement <= eps:
+            return mu.copy(), num_iter
+        num_iter += 1
+
+        if restart:
+            t = 1.
+            np.copyto(y, mu)
+            continue
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        # y = mu + (t - 1) / t_next * (mu - mu_prev)
+        np.subtract(mu, mu_prev, out=y)
+        y *= (t - 1) / t_next
+        y += mu
+        t = t_next
+
+    print('Ran out of Max iter for GM - returning sub optimal answer')
+    return mu.copy(), num_iter
+
+
+def smoothed_weiszfeld(X: np.ndarray, eps: float, max_iter: int, init: np.ndarray = None, kernel: GMKernel = None,
+                       nu_init: float = 0.1, nu_decay: float = 0.1):
+    """
+    Weiszfeld on the smoothed objective sum_i sqrt(||x_i - mu||^2 + nu^2) with nu decreased geometrically
+    (continuation) : nu starts at nu_init x the mean distance to the initial point and is multiplied by nu_decay
+    at every iteration until it reaches eps. Smoothing removes the zero distance special case and damps the
+    early iterations. returns gm, num_iter
+    """
+    kernel = kernel or GMKernel()
+    kernel.prepare(X)
+    mu, mu1 = kernel.init_mu(X=X, init=init), kernel.mu1
+    nu = nu_init * float(kernel.distances(X=X, mu=mu).mean())
+    num_iter = 0
+    while num_iter < max_iter:
+        kernel.weiszfeld_step(X=X, mu=mu, out=mu1, nu=nu)
+        guess_movement = kernel.movement(mu=mu, mu1=mu1)
+
+        mu, mu1 = mu1, mu
+        if guess_movement <= eps and nu <= eps:
+            return mu.copy(), num_iter
+        nu = max(nu * nu_decay, eps)
+        num_iter += 1
+
+    print('Ran out of Max iter for GM - returning sub optimal answer')
+    return mu.copy(), num_iter
+
+
+def stochastic_weiszfeld(X: np.ndarray, eps: float, max_iter: int, init: np.ndarray = None, kernel: GMKernel = None,
+                         sample_frac: float = 0.125, stage_iter: int = 2, rng: np.random.Generator = None,
+                         sub_kernels: dict = None):
+    """
+    Row subsampled Weiszfeld for large n : stage_iter Weiszfeld iterations on a random subset of the rows, doubling
+    the subset till it covers all the rows, then regular Weiszfeld (to eps) on X ; each stage warm started from the
+    previous one. The early iterations read a fraction of X.
+    sub_kernels: {num rows : GMKernel} buffers of the subsets reused across calls
+    returns gm, num_iter (total over the stages)
+    """
+    rng = rng or np.random.default_rng()
+    sub_kernels = {} if sub_kernels is None else sub_kernels
+    n = X.shape[0]
+    num_rows = max(2, int(sample_frac * n))
+    mu = init
+    num_iter = 0
+    while num_rows < n and num_iter < max_iter:
+        rows = np.sort(rng.choice(n, size=num_rows, replace=False))
+        X_sub = np.take(X, rows, axis=0)
+        sub_kernel = sub_kernels.setdefault(num_rows, GMKernel(chunk_size=kernel.chunk_size if kernel else None))
+        sub_kernel.prepare(X_sub)
+        mu, mu1 = sub_kernel.init_mu(X=X_sub, init=mu), sub_kernel.mu1
+        for _ in range(stage_iter):
+            sub_kernel.weiszfeld_step(X=X_sub, mu=mu, out=mu1)
+            mu, mu1 = mu1, mu
+        num_iter += stage_iter
+        num_rows *= 2
+    gm, final_iter = weiszfeld(X=X, eps=eps, max_iter=max(max_iter - num_iter, 1), init=mu, kernel=kernel)
+    return gm, num_iter + final_iter
+
+
+if __name__ == '__main__':
+    # Benchmark the solvers against vardi : iterations / wall time / objective gap to a tight float64 solve
+    import time
+    bench_rng = np.random.default_rng(0)
+
+    def objective(X, mu):
+        bench_kernel = GMKernel()
+        bench_kernel.prepare(X)
+        return float(bench_kernel.distances(X=X, mu=mu).sum())
+
+    for n, d in [(64, 100000), (512, 10000)]:
+        # grads sharing a low rank structure + 20 % far away byzantine rows
+        G = 1 + 0.3 * bench_rng.standard_normal((n, 3)) @ bench_rng.standard_normal((3, d)) + \
+            0.01 * bench_rng.standard_normal((n, d))
+        G[:n // 5] = 3 * bench_rng.standard_normal((n // 5, d))
+        ref, _ = weiszfeld(X=G, eps=1e-10, max_iter=5000)
+        ref_obj = objective(X=G, mu=ref)
+        G = G.astype(np.float32)
+        print('n = {} d = {}'.format(n, d))
+        for name, solver, kwargs in [('vardi', vardi, {}), ('wzfld', weiszfeld, {}),
+                                     ('accel_wzfld', accelerated_weiszfeld, {}),
+                                     ('smooth_wzfld', smoothed_weiszfeld, {}),
+                                     ('stoch_wzfld', stochastic_weiszfeld, {'rng': np.random.default_rng(0)})]:
+            bench_kernel = GMKernel()
+            t0 = time.time()
+            gm, iters = solver(X=G, eps=1e-5, max_iter=500, kernel=bench_kernel, **kwargs)
+            t = time.time() - t0
+            gap = (objective(X=G.astype(np.float64), mu=gm.astype(np.float64)) - ref_obj) / ref_obj
+            print('{:>14} : iter {:4d}  time {:.3f}s  rel objective gap {:.1e}'.format(name, iters, t, gap))
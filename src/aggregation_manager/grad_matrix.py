@@ -0,0 +1,42 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import numpy as np
+import torch
+
+"""
+Preallocated storage for the Gradient Matrix G where each row is a gradient vector g_i.
+Contract: every stage of the aggregation pipeline (attack, compression, sparse approximation, GAR)
+works in place on G or reads views of it - no stage allocates another n x d matrix.
+"""
+
+
+class GradMatrix:
+    def __init__(self, n: int, d: int, dtype=np.float32, num_buffers: int = 2, shared_memory: bool = False):
+        """
+        Owns a (num_buffers x n x d) arena. With 2 buffers (double buffering) the next round of
+        gradients can be written into one buffer while the current one is being aggregated.
+        shared_memory: place the arena in shared memory so that worker processes can write rows into it
+        """
+        self.n = n
+        self.d = d
+        if shared_memory:
+            self.shared_arena = torch.zeros((num_buffers, n, d), dtype=torch.from_numpy(np.zeros(0, dtype)).dtype)
+            self.shared_arena.share_memory_()
+            self.arena = self.shared_arena.numpy()
+        else:
+            self.shared_arena = None
+            self.arena = np.zeros((num_buffers, n, d), dtype=dtype)
+        self.curr = 0
+
+    @property
+    def G(self) -> np.ndarray:
+        """ Current buffer """
+        return self.arena[self.curr]
+
+    @property
+    def num_buffers(self) -> int:
+        return self.arena.shape[0]
+
+    def buffer(self, ix: int) -> np.ndarray:
+        return self.arena[ix]
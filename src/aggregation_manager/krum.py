@@ -1,37 +1,72 @@
 # Copyright (c) Anish Acharya.
 # Licensed under the MIT License
 
+"""
+Krum / Multi-Krum : Blanchard et.al. "Machine Learning with Adversaries: Byzantine Tolerant Gradient Descent"
+(NeurIPS 2017). The pairwise distances come from a single Gram matrix of the (column centered) grads and the scores
+from a vectorized partial sort.
+"""
 import numpy as np
 from .base import GAR
+from typing import List
+import time
 
 
 class Krum(GAR):
     def __init__(self, aggregation_config):
         GAR.__init__(self, aggregation_config=aggregation_config)
-
-    def aggregate(self, G: np.ndarray) -> np.ndarray:
-        dist = self.get_krum_dist(G=G)
         krum_conf = self.aggregation_config.get("krum_config", {})
+        self.krum_frac = krum_conf.get("krum_frac", 0.3)
+        # number of lowest score grads averaged (1 : Krum)
+        self.multi_krum_m = krum_conf.get("multi_krum_m", 1)
+        # columns processed at once while building the Gram matrix
+        self.chunk_size = krum_conf.get("chunk_size", 2 ** 12)
+
+    def aggregate(self, G: np.ndarray, ix: List[int] = None) -> np.ndarray:
+        # if ix given only aggregate along the indexes ignoring the rest of the ix
+        if ix is not None:
+            g_agg = np.zeros(G.shape[1], dtype=self.acc_dtype(G))
+            G = self.gather_columns(G=G, ix=ix)
+            t0 = time.time()
+            g_agg[ix] = self.krum(G=G)
+            self.agg_time = time.time() - t0
+            return g_agg
+        else:
+            t0 = time.time()
+            g_agg = self.krum(G=G)
+            self.agg_time = time.time() - t0
+            return g_agg
 
-        m = int(krum_conf.get("krum_frac", 0.3) * G.shape[0])
-        min_score = 1e10
-        optimal_client_ix = -1
+    def krum(self, G: np.ndarray) -> np.ndarray:
+        dist = self.get_krum_dist(G=G, chunk_size=self.chunk_size)
+        # score of g_i : sum of its m smallest distances (self included)
+        m = int(self.krum_frac * G.shape[0])
+        if m > 0:
+            scores = np.partition(dist, m - 1, axis=1)[:, :m].sum(axis=1)
+        else:
+            scores = np.zeros(G.shape[0])
 
-        for ix in range(G.shape[0]):
-            curr_dist = dist[ix, :]
-            curr_dist = np.sort(curr_dist)
-            curr_score = sum(curr_dist[:m])
-            if curr_score < min_score:
-                min_score = curr_score
-                optimal_client_ix = ix
-        krum_grad = G[optimal_client_ix, :]
-        return krum_grad
+        if self.multi_krum_m == 1:
+            return G[np.argmin(scores), :].astype(self.acc_dtype(G))
+        selected = np.sort(np.argsort(scores, kind='stable')[:self.multi_krum_m])
+        return self.weighted_average(stacked_grad=G[selected, :])
 
     @staticmethod
-    def get_krum_dist(G: np.ndarray) -> np.ndarray:
-        """ Computes distance between each pair of client based on grad value """
-        dist = np.zeros((G.shape[0], G.shape[0]))
-        for i in range(G.shape[0]):
-            for j in range(i):
-                dist[i][j] = dist[j][i] = np.linalg.norm(G[i, :] - G[j, :])
-        return dist
+    def get_krum_dist(G: np.ndarray, chunk_size: int = 2 ** 12) -> np.ndarray:
+        """
+        Computes distance between each pair of client based on grad value :
+        ||g_i - g_j||^2 = K_ii + K_jj - 2 K_ij with K the Gram matrix of G. The columns are centered (distances are
+        translation invariant) to limit cancellation and K is accumulated over column chunks in float32 (or higher)
+        """
+        n = G.shape[0]
+        acc_dtype = GAR.acc_dtype(G)
+        K = np.zeros((n, n), dtype=acc_dtype)
+        for start in range(0, G.shape[1], chunk_size):
+            block = G[:, start:start + chunk_size].astype(acc_dtype)
+            block -= block.mean(axis=0)
+            K += block @ block.T
+        sq_norms = np.diag(K)
+        dist = sq_norms[:, None] + sq_norms[None, :] - 2 * K
+        np.maximum(dist, 0, out=dist)
+        np.fill_diagonal(dist, 0)
+        return np.sqrt(dist)
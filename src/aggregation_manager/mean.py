@@ -18,8 +18,8 @@ class Mean(GAR):
     def aggregate(self, G: np.ndarray, ix: List[int] = None) -> np.ndarray:
         # if ix given only aggregate along the indexes ignoring the rest of the ix
         if ix is not None:
-            g_agg = np.zeros_like(G[0, :])
-            G = G[:, ix]
+            g_agg = np.zeros(G.shape[1], dtype=self.acc_dtype(G))
+            G = self.gather_columns(G=G, ix=ix)
             t0 = time.time()
             low_rank_mean = self.weighted_average(stacked_grad=G)
             g_agg[ix] = low_rank_mean
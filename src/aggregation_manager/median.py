@@ -3,7 +3,9 @@
 import numpy as np
 from .base import GAR
 from typing import List, Dict
-from scipy.spatial.distance import cdist, euclidean
+from .gm_kernels import GMKernel
+from .coordinate_wise import CoordinateWiseEngine
+from . import gm_kernels
 import torch.optim as opt
 import torch.nn as nn
 import time
@@ -12,19 +14,25 @@ import time
 class CoordinateWiseMedian(GAR):
     def __init__(self, aggregation_config):
         GAR.__init__(self, aggregation_config=aggregation_config)
+        coordinate_wise_config = aggregation_config.get('coordinate_wise_config', {})
+        self.engine = CoordinateWiseEngine(num_threads=coordinate_wise_config.get('num_threads', None),
+                                           block_size=coordinate_wise_config.get('block_size', None))
+
+    def close(self):
+        self.engine.close()
 
     def aggregate(self, G: np.ndarray, ix: List[int] = None) -> np.ndarray:
         if ix is not None:
             t0 = time.time()
-            g_agg = np.zeros_like(G[0, :])
-            G = G[:, ix]
-            low_rank_med = np.median(G, axis=0)
+            g_agg = np.zeros(G.shape[1], dtype=self.acc_dtype(G))
+            G = self.gather_columns(G=G, ix=ix)
+            low_rank_med = self.engine.median(G=G)
             g_agg[ix] = low_rank_med
             self.agg_time = time.time() - t0
             return g_agg
         else:
             t0 = time.time()
-            g_agg = np.median(G, axis=0)
+            g_agg = self.engine.median(G=G)
             self.agg_time = time.time() - t0
             return g_agg
 
@@ -36,18 +44,45 @@ class GeometricMedian(GAR):
         self.geo_med_alg = self.geo_med_config.get('alg', 'weiszfeld')
         self.eps = self.geo_med_config.get('eps', 1e-5)
         self.max_iter = self.geo_med_config.get('max_iter', 500)
+        # preallocated buffers of the solvers
+        self.kernel = GMKernel(chunk_size=self.geo_med_config.get('chunk_size', None))
+        # smoothed weiszfeld
+        self.nu_init = self.geo_med_config.get('nu_init', 0.1)
+        self.nu_decay = self.geo_med_config.get('nu_decay', 0.1)
+        # stochastic (row subsampled) weiszfeld
+        self.sample_frac = self.geo_med_config.get('sample_frac', 0.125)
+        self.stage_iter = self.geo_med_config.get('stage_iter', 2)
+        self.rng = np.random.default_rng(self.geo_med_config.get('seed', 1))
+        self.sub_kernels = {}
+
+        # warm start from the previous round's gm (optionally rescaled by lr / lr of the previous round)
+        self.warm_start = self.geo_med_config.get('warm_start', False)
+        self.warm_start_lr_rescale = self.geo_med_config.get('warm_start_lr_rescale', False)
+        self.warm_point = None
+        self.warm_lr = None
+        # running mean of the iterations of cold (mean) starts - to estimate the iterations saved
+        self.cold_iter_avg = 0
+        self.num_cold_starts = 0
 
         print('Max GM iter = {}'.format(self.max_iter))
         print(self.geo_med_config)
 
         print("GM Algorithm: {}".format(self.geo_med_alg))
 
-    def get_gm(self, X: np.ndarray):
+    def get_gm(self, X: np.ndarray, init: np.ndarray = None):
 
         if self.geo_med_alg == 'vardi':
-            gm = self.vardi(X=X, eps=self.eps, max_iter=self.max_iter)
+            gm = self.vardi(X=X, eps=self.eps, max_iter=self.max_iter, init=init)
         elif self.geo_med_alg == 'wzfld':
-            gm = self.weiszfeld(X=X, eps=self.eps, max_iter=self.max_iter)
+            gm = self.weiszfeld(X=X, eps=self.eps, max_iter=self.max_iter, init=init)
+        elif self.geo_med_alg == 'accel_wzfld':
+            gm = self.run_solver(gm_kernels.accelerated_weiszfeld, X=X, init=init)
+        elif self.geo_med_alg == 'smooth_wzfld':
+            gm = self.run_solver(gm_kernels.smoothed_weiszfeld, X=X, init=init, nu_init=self.nu_init,
+                                 nu_decay=self.nu_decay)
+        elif self.geo_med_alg == 'stoch_wzfld':
+            gm = self.run_solver(gm_kernels.stochastic_weiszfeld, X=X, init=init, sample_frac=self.sample_frac,
+                                 stage_iter=self.stage_iter, rng=self.rng, sub_kernels=self.sub_kernels)
         elif self.geo_med_alg == 'cvx_opt':
             gm = self.cvx_opt(X=X, eps=self.eps, max_iter=self.max_iter)
         else:
@@ -58,91 +93,104 @@ class GeometricMedian(GAR):
     def aggregate(self, G: np.ndarray, ix: List[int] = None) -> np.ndarray:
         # if ix given only aggregate along the indexes ignoring the rest of the ix
         if ix is not None:
-            g_agg = np.zeros_like(G[0, :])
-            G = G[:, ix]
-            low_rank_gm = self.get_gm(X=G)
-            g_agg[ix] = low_rank_gm
+            g_agg = np.zeros(G.shape[1], dtype=self.acc_dtype(G))
+            X = self.gather_columns(G=G, ix=ix)
+        else:
+            g_agg, X = None, G
+
+        t0 = time.time()
+        init = self.initial_guess(X=X, ix=ix)
+        init_time = time.time() - t0
+        gm = self.get_gm(X=X, init=init)
+        self.agg_time += init_time
+        self.update_warm_start(gm=gm, d=G.shape[1], ix=ix, warm=init is not None)
+
+        if ix is not None:
+            g_agg[ix] = gm
             return g_agg
+        return gm
+
+    def initial_guess(self, X: np.ndarray, ix: List[int] = None):
+        """
+        returns the warm start point if it has a lower GM objective (sum of distances) than the mean,
+        else None : the solvers start from the mean
+        """
+        if not self.warm_start or self.warm_point is None:
+            return None
+        warm = self.warm_point if ix is None else self.warm_point[ix]
+        if self.warm_start_lr_rescale and self.lr and self.warm_lr:
+            warm = warm * (self.lr / self.warm_lr)
+        mean = np.mean(X, 0, dtype=self.acc_dtype(X))
+        if self.gm_objective(X=X, mu=warm) < self.gm_objective(X=X, mu=mean):
+            return np.array(warm, dtype=self.acc_dtype(X))
+        return None
+
+    def update_warm_start(self, gm: np.ndarray, d: int, ix: List[int] = None, warm: bool = False):
+        """ stores gm as the next warm start point and the iterations saved by this round's warm start """
+        if warm:
+            self.iter_saved = max(0., self.cold_iter_avg - self.num_iter)
         else:
-            return self.get_gm(X=G)
+            self.num_cold_starts += 1
+            self.cold_iter_avg += (self.num_iter - self.cold_iter_avg) / self.num_cold_starts
+        if not self.warm_start:
+            return
+        if self.warm_point is None or len(self.warm_point) != d:
+            self.warm_point = np.zeros(d, dtype=gm.dtype)
+        if ix is None:
+            self.warm_point[:] = gm
+        else:
+            self.warm_point[ix] = gm
+        self.warm_lr = self.lr
+
+    def gm_objective(self, X: np.ndarray, mu: np.ndarray) -> float:
+        self.kernel.prepare(X)
+        return float(self.kernel.distances(X=X, mu=mu).sum())
+
+    def get_state(self):
+        """ returns (state, arrays) to checkpoint the warm start """
+        state = {"warm_lr": self.warm_lr, "cold_iter_avg": self.cold_iter_avg,
+                 "num_cold_starts": self.num_cold_starts, "rng": self.rng.bit_generator.state}
+        arrays = {"warm_point": self.warm_point} if self.warm_point is not None else {}
+        return state, arrays
+
+    def set_state(self, state, arrays):
+        self.warm_lr = state["warm_lr"]
+        self.cold_iter_avg = state["cold_iter_avg"]
+        self.num_cold_starts = state["num_cold_starts"]
+        self.rng.bit_generator.state = state["rng"]
+        if "warm_point" in arrays:
+            self.warm_point = np.array(arrays["warm_point"])
 
     # ------------------------------------ #
     # Different GM Algorithms implemented  #
     # ------------------------------------ #
 
-    def vardi(self, X, eps, max_iter) -> np.ndarray:
-        # Copyright (c) Orson Peters
-        # Licensed under zlib License
-        # Reference: https://stackoverflow.com/questions/30299267/geometric-median-of-multidimensional-points
+    def vardi(self, X, eps, max_iter, init=None) -> np.ndarray:
         """
         Implementation of "The multivariate L1-median and associated data depth;
         Yehuda Vardi and Cun-Hui Zhang; PNAS'2000"
         """
-        # initial guess
         t0 = time.time()
-        mu = np.mean(X, 0)
-        mu = np.nan_to_num(mu, copy=False, nan=0, posinf=0, neginf=0)
-        num_iter = 1
-        while num_iter < max_iter:
-            # noinspection PyTypeChecker
-            D = cdist(X, [mu]).astype(mu.dtype)
-            non_zeros = (D != 0)[:, 0]
-            D_inv = 1 / D[non_zeros]
-            W = np.divide(D_inv, sum(D_inv))
-            T = np.sum(W * X[non_zeros], 0)
-            num_zeros = len(X) - np.sum(non_zeros)
-
-            if num_zeros == 0:
-                mu1 = T
-            elif num_zeros == len(X):
-                self.agg_time = time.time() - t0
-                self.num_iter = num_iter
-                return mu
-            else:
-                r = np.linalg.norm((T - mu) * sum(D_inv))
-                r_inv = 0 if r == 0 else num_zeros / r
-                mu1 = max(0, 1 - r_inv) * T + min(1, r_inv) * mu
-
-            mu1 = np.nan_to_num(mu1, copy=False, nan=0, posinf=0, neginf=0)
-
-            if euclidean(mu, mu1) < eps:
-                self.agg_time = time.time() - t0
-                self.num_iter = num_iter
-                return mu
-
-            mu = mu1
-            num_iter += 1
-
+        mu, self.num_iter = gm_kernels.vardi(X=X, eps=eps, max_iter=max_iter, init=init, kernel=self.kernel)
         self.agg_time = time.time() - t0
-        self.num_iter = num_iter
-        print('Ran out of Max iter for GM - returning all zero')
-        return np.zeros_like(mu)
+        return mu
 
-    def weiszfeld(self, X, eps, max_iter):
-        # inspired by: https://github.com/mrwojo
+    def weiszfeld(self, X, eps, max_iter, init=None):
         """
         Implements: On the point for which the sum of the distances to n given points is minimum
         E Weiszfeld, F Plastria: Annals of Operations Research
         """
-        # initial Guess : centroid / empirical mean
         t0 = time.time()
-        mu = np.mean(X, 0)
-        num_iter = 0
-        while num_iter < max_iter:
-            # noinspection PyTypeChecker
-            distances = cdist(X, [mu]).astype(mu.dtype)
-            distances = np.where(distances == 0, 1, distances)
-            mu1 = (X / distances).sum(axis=0) / (1. / distances).sum(axis=0)
-            guess_movement = np.sqrt(((mu - mu1) ** 2).sum())
-
-            mu = mu1
-            if guess_movement <= eps:
-                self.agg_time = time.time() - t0
-                return mu
-            num_iter += 1
+        mu, self.num_iter = gm_kernels.weiszfeld(X=X, eps=eps, max_iter=max_iter, init=init, kernel=self.kernel)
+        self.agg_time = time.time() - t0
+        return mu
 
+    def run_solver(self, solver, X, init=None, **kwargs) -> np.ndarray:
+        """ runs a gm_kernels solver - recording its time and iterations """
+        t0 = time.time()
+        mu, self.num_iter = solver(X=X, eps=self.eps, max_iter=self.max_iter, init=init, kernel=self.kernel,
+                                   **kwargs)
         self.agg_time = time.time() - t0
-        print('Ran out of Max iter for GM - returning sub optimal answer')
         return mu
 
     def cvx_opt(self, X, eps=1e-5, max_iter=1000):
@@ -4,6 +4,7 @@
 import numpy as np
 from .base import GAR
 from typing import List
+import time
 
 """
 Ghosh et.al. Communication-Efficient and Byzantine-Robust Distributed Learning with Error Feedback
@@ -19,22 +20,29 @@ class NormClipping(GAR):
         self.k = None
 
     def aggregate(self, G: np.ndarray, ix: List[int] = None) -> np.ndarray:
-        # Compute norms of each gradient vector
-        # norm_dist = np.linalg.norm(G, axis=1)
-
+        t0 = time.time()
         if self.k is None:
             self.k = int(G.shape[0] * self.alpha)
             print('Norm clipping {} clients'.format(self.k))
 
-        norms = np.sqrt(np.einsum('ij,ij->i', G, G))
+        # if ix given only aggregate along the indexes ignoring the rest of the ix
+        # (G is zero outside ix after the sparse approximation so the block norms are the row norms)
+        agg_grad = None
+        if ix is not None:
+            agg_grad = np.zeros(G.shape[1], dtype=self.acc_dtype(G))
+            G = self.gather_columns(G=G, ix=ix)
+
+        # Compute norms of each gradient vector
+        norms = np.sqrt(np.einsum('ij,ij->i', G, G, dtype=self.acc_dtype(G)))
         top_k_indices = np.argsort(np.abs(norms))[::-1][:self.k]
 
         # set weights of them to 0 filtering k top ones based on norm
         alphas = np.ones(G.shape[0]) * (1 / (G.shape[0] - self.k))
         alphas[top_k_indices] = 0
-        agg_grad = self.weighted_average(stacked_grad=G, alphas=alphas)
 
         if ix is not None:
-            return agg_grad[ix]
+            agg_grad[ix] = self.weighted_average(stacked_grad=G, alphas=alphas)
         else:
-            return agg_grad
+            agg_grad = self.weighted_average(stacked_grad=G, alphas=alphas)
+        self.agg_time = time.time() - t0
+        return agg_grad
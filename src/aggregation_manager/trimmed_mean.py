@@ -2,8 +2,9 @@
 # Licensed under the MIT License
 import numpy as np
 from .base import GAR
-from scipy import stats
+from .coordinate_wise import CoordinateWiseEngine
 from typing import List
+import time
 """
 Computes Trimmed mean estimates
 Cite: Yin, Chen, Ramchandran, Bartlett : Byzantine-Robust Distributed Learning: Towards Optimal Statistical Rates 
@@ -15,11 +16,24 @@ class TrimmedMean(GAR):
         GAR.__init__(self, aggregation_config=aggregation_config)
         self.trimmed_mean_config = aggregation_config.get('trimmed_mean_config', {})
         self.proportion = self.trimmed_mean_config.get('proportion', 0.1)
-        self.axis = self.trimmed_mean_config.get('axis', 0)
+        coordinate_wise_config = aggregation_config.get('coordinate_wise_config', {})
+        self.engine = CoordinateWiseEngine(num_threads=coordinate_wise_config.get('num_threads', None),
+                                           block_size=coordinate_wise_config.get('block_size', None))
+
+    def close(self):
+        self.engine.close()
 
     def aggregate(self, G: np.ndarray, ix: List[int] = None) -> np.ndarray:
-        agg_grad = stats.trim_mean(a=G, proportiontocut=self.proportion, axis=self.axis)
+        # if ix given only aggregate along the indexes ignoring the rest of the ix
         if ix is not None:
-            return agg_grad[ix]
+            t0 = time.time()
+            agg_grad = np.zeros(G.shape[1], dtype=self.acc_dtype(G))
+            G = self.gather_columns(G=G, ix=ix)
+            agg_grad[ix] = self.engine.trimmed_mean(G=G, proportion=self.proportion)
+            self.agg_time = time.time() - t0
+            return agg_grad
         else:
+            t0 = time.time()
+            agg_grad = self.engine.trimmed_mean(G=G, proportion=self.proportion)
+            self.agg_time = time.time() - t0
             return agg_grad
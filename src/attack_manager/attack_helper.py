@@ -1,34 +1,40 @@
 # Copyright (c) Anish Acharya.
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License
-from .grad_attack_models import (DriftAttack, Additive, Random,
+from .grad_attack_models import (DriftAttack, IPMAttack, Additive, Random,
                                  BitFlipAttack, RandomSignFlipAttack)
 from .image_corruption_models import *
 from .backdoor import *
 from typing import Dict
 
 
-def get_grad_attack(attack_config: Dict):
+def get_grad_attack(attack_config: Dict, seed: int = 1):
     if attack_config["attack_model"] == 'drift':
-        return DriftAttack(attack_config=attack_config)
+        return DriftAttack(attack_config=attack_config, seed=seed)
+    elif attack_config["attack_model"] == 'ipm':
+        return IPMAttack(attack_config=attack_config, seed=seed)
     elif attack_config["attack_model"] == 'additive':
-        return Additive(attack_config=attack_config)
+        return Additive(attack_config=attack_config, seed=seed)
     elif attack_config["attack_model"] == 'random':
-        return Random(attack_config=attack_config)
+        return Random(attack_config=attack_config, seed=seed)
     elif attack_config["attack_model"] == 'bit_flip':
-        return BitFlipAttack(attack_config=attack_config)
+        return BitFlipAttack(attack_config=attack_config, seed=seed)
     elif attack_config["attack_model"] == 'random_sign_flip':
-        return RandomSignFlipAttack(attack_config=attack_config)
+        return RandomSignFlipAttack(attack_config=attack_config, seed=seed)
     else:
         return None
 
 
-def get_feature_attack(attack_config: Dict):
+def get_feature_attack(attack_config: Dict, seed: int = 1):
     if attack_config["noise_model"] == 'additive':
-        return ImageAdditive(attack_config=attack_config)
+        return ImageAdditive(attack_config=attack_config, seed=seed)
     elif attack_config["noise_model"] == 'impulse':
-        return ImageImpulse(attack_config=attack_config)
+        return ImageImpulse(attack_config=attack_config, seed=seed)
     elif attack_config["noise_model"] == 'backdoor':
-        return Backdoor(attack_config=attack_config)
+        return Backdoor(attack_config=attack_config, seed=seed)
+    elif attack_config["noise_model"] == 'random_label_flip':
+        return RandomLabelFlip(attack_config=attack_config, seed=seed)
+    elif attack_config["noise_model"] == 'label_flip':
+        return LabelFlip(attack_config=attack_config, seed=seed)
     else:
         return None
@@ -1,36 +1,85 @@
 from typing import Dict
+import torch
 
 """
-Implements Backdoor Attack , Random Label Corruption  
+Implements Backdoor Attack , Random Label Corruption , Class Conditional Label Flips
+The labels of a whole batch (or the masked samples of it) are corrupted by a single tensor op.
 """
 
 
 class LabelCorruption:
     """ This is the Base Class for Image Corruptions. """
-    def __init__(self, attack_config: Dict):
+    def __init__(self, attack_config: Dict, seed: int = 1):
         self.attack_config = attack_config
         self.noise_model = self.attack_config.get("noise_model", None)
         self.frac_adv = self.attack_config.get('frac_adv', 0)
 
         self.target_class = self.attack_config.get('backdoor_label', 0)
+        self.num_labels = self.attack_config.get('num_labels', 10)
 
         self.num_corrupt = 0
         self.curr_corr = 0
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
 
-    def attack(self, X, Y):
+    def attack(self, X, Y, mask=None):
+        """ corrupts the labels Y in place ; mask: (b,) bool - corrupt only these samples (None : all) """
         if self.curr_corr > 0:
             # apply attack
-            for ix, sample in enumerate(Y):
-                Y[ix] = self.corrupt()
+            if mask is None:
+                Y.copy_(self.corrupt(Y=Y))
+            else:
+                Y[mask] = self.corrupt(Y=Y[mask])
         return X, Y
 
-    def corrupt(self):
+    def corrupt(self, Y: torch.Tensor) -> torch.Tensor:
+        """ returns the corrupted labels of the (b,) labels Y """
         raise NotImplementedError('You need to Implement this method for each attack class')
 
 
 class Backdoor(LabelCorruption):
-    def __init__(self, attack_config: Dict):
-        LabelCorruption.__init__(self, attack_config=attack_config)
+    def __init__(self, attack_config: Dict, seed: int = 1):
+        LabelCorruption.__init__(self, attack_config=attack_config, seed=seed)
 
-    def corrupt(self):
-        return self.target_class
+    def corrupt(self, Y):
+        return torch.full_like(Y, self.target_class)
+
+
+class RandomLabelFlip(LabelCorruption):
+    """ every corrupted label is replaced by a uniformly drawn different label """
+    def __init__(self, attack_config: Dict, seed: int = 1):
+        LabelCorruption.__init__(self, attack_config=attack_config, seed=seed)
+
+    def corrupt(self, Y):
+        shift = torch.randint(1, self.num_labels, Y.shape, generator=self.generator).to(Y.device)
+        return (Y + shift) % self.num_labels
+
+
+class LabelFlip(LabelCorruption):
+    """
+    Class conditional flips : label y is replaced by a label drawn from row y of flip_matrix (num_labels x num_labels,
+    rows are normalized). Default : pair flip y -> (y + 1) % num_labels
+    """
+    def __init__(self, attack_config: Dict, seed: int = 1):
+        LabelCorruption.__init__(self, attack_config=attack_config, seed=seed)
+        flip_matrix = self.attack_config.get('flip_matrix', None)
+        if flip_matrix is None:
+            self.flip_matrix = torch.roll(torch.eye(self.num_labels), shifts=1, dims=1)
+        else:
+            self.flip_matrix = torch.as_tensor(flip_matrix, dtype=torch.float32)
+            if self.flip_matrix.shape != (self.num_labels, self.num_labels):
+                raise ValueError('flip_matrix must be num_labels x num_labels ({0} x {0}), got {1}'
+                                 .format(self.num_labels, tuple(self.flip_matrix.shape)))
+            if not torch.isfinite(self.flip_matrix).all() or (self.flip_matrix < 0).any():
+                raise ValueError('flip_matrix entries must be finite and non negative')
+            row_sums = self.flip_matrix.sum(dim=1, keepdim=True)
+            if (row_sums == 0).any():
+                raise ValueError('flip_matrix rows {} are all zero - every label needs a flip distribution'
+                                 .format(torch.nonzero(row_sums.reshape(-1) == 0).reshape(-1).tolist()))
+            self.flip_matrix /= row_sums
+
+    def corrupt(self, Y):
+        if len(Y) == 0:
+            return Y
+        probs = self.flip_matrix[Y.cpu()]
+        return torch.multinomial(probs, num_samples=1, generator=self.generator).reshape(-1).to(Y)
@@ -3,76 +3,130 @@
 # Licensed under the MIT License
 
 import numpy as np
+from scipy.stats import norm
 from typing import Dict
 import warnings
 
 
 class ByzAttack:
-    """ This is the Base Class for Byzantine attack. """
+    """
+    This is the Base Class for Byzantine attack.
+    The Byzantine rows of G are drawn once per round (from the attack's own np.random.Generator) and
+    attack() transforms all of them at once.
+    """
 
     def __init__(self, attack_config: Dict, seed=1):
         self.attack_config = attack_config
         self.seed = seed
+        self.rng = np.random.default_rng(seed)
         self.attack_mode = self.attack_config.get('attack_mode', 'un_coordinated')
         self.attack_algorithm = self.attack_config.get('attack_model', None)
         self.frac_adv = self.attack_config.get('frac_adv', 0)
 
-    def attack(self, g: np.array):
+    def attack(self, G: np.ndarray) -> np.ndarray:
+        """ G: (k x d) byzantine rows - transformed in place and returned """
         pass
 
+    def byz_rows(self, n: int) -> np.ndarray:
+        """ indices of the byzantine rows : each row is byzantine w.p. frac_adv, at most int(frac_adv * n) of them """
+        byz = np.flatnonzero(self.rng.random(n) < self.frac_adv)
+        max_adv = int(self.frac_adv * n)
+        return byz[:max_adv] if max_adv > 0 else byz
+
     def launch_attack(self, G: np.ndarray):
-        np.random.seed(self.seed)
-        max_adv = int(self.frac_adv * G.shape[0])
         if self.attack_mode == 'un_coordinated':
-            for i in range(G.shape[0]):
-                # Toss a coin
-                if np.random.random_sample() < self.frac_adv:
-                    perturbed_grad = self.attack(g=G[i, :])
-                    G[i, :] = perturbed_grad
-                    max_adv -= 1
-
-                if max_adv == 0:
-                    return G
-
-                else:
-                    continue
+            byz = self.byz_rows(n=G.shape[0])
+            if len(byz) > 0:
+                G[byz] = self.attack(G=G[byz])
         elif self.attack_mode == 'coordinated':
-            perturbed_grad = self.attack(g=G[0, :])
-            for i in range(G.shape[0]):
-                if np.random.random_sample() < self.frac_adv:
-                    G[i, :] = perturbed_grad
-                else:
-                    continue
+            perturbed_grad = self.attack(G=G[:1].copy())
+            byz = np.flatnonzero(self.rng.random(G.shape[0]) < self.frac_adv)
+            G[byz] = perturbed_grad
 
             # raise NotImplementedError
         return G
 
+    def _noise(self, shape, dtype) -> np.ndarray:
+        """ Gaussian (scaled by attack_std) or uniform (in noise_range) noise """
+        dtype = np.promote_types(dtype, np.float32)
+        if self.noise_dist == 'gaussian':
+            noise = self.rng.standard_normal(size=shape, dtype=dtype)
+            noise *= self.attack_std
+        elif self.noise_dist == 'uniform':
+            noise = self.rng.random(size=shape, dtype=dtype)
+            noise *= self.noise_range[1] - self.noise_range[0]
+            noise += self.noise_range[0]
+        else:
+            raise NotImplementedError
+        return noise
+
 
 class DriftAttack(ByzAttack):
     """
     Implementation of the powerful drift attack algorithm proposed in:
     Ref: Gilad Baruch et.al. "A Little Is Enough: Circumventing Defenses For Distributed Learning" (NeurIPS 2019)
     https://github.com/moranant/attacking_distributed_learning
+
+    Co-ordinated by design : int(frac_adv * n) rows of G are overwritten by mu - n_std * sigma where mu, sigma
+    are the co-ordinate wise mean / std of the honest rows. attack_n_std = None uses z_max of the paper.
     """
 
-    def __init__(self, attack_config: Dict):
-        ByzAttack.__init__(self, attack_config=attack_config)
-        self.n_std = attack_config["attack_n_std"]
-
-    def attack(self, byz_clients):
-        if len(byz_clients) <= 1 or self.n_std == 0:
-            warnings.warn(message='Drift Attack is implemented as a co-ordinated only attack,'
-                                  'In the un-coordinated mode we are leaving the grads unchanged')
-            return
-        clients_grad = []
-        for client in byz_clients:
-            clients_grad.append(client.grad)
-        grad_mean = np.mean(clients_grad, axis=0)
-        grad_std = np.var(clients_grad, axis=0) ** 0.5
+    def __init__(self, attack_config: Dict, seed=1):
+        ByzAttack.__init__(self, attack_config=attack_config, seed=seed)
+        self.n_std = attack_config.get("attack_n_std", None)
+        # number of columns processed at once - bounds the temporaries to ~ n x chunk_size
+        self.chunk_size = attack_config.get("chunk_size", 2 ** 16)
+
+    def z_max(self, n: int, num_byz: int) -> float:
+        """ largest deviation (in std) that still places the byzantine grads among the majority """
+        s = np.floor(n / 2 + 1) - num_byz
+        return norm.ppf((n - s) / n)
+
+    def launch_attack(self, G: np.ndarray):
+        n = G.shape[0]
+        num_byz = int(self.frac_adv * n)
+        if num_byz == 0 or num_byz == n:
+            warnings.warn(message='Drift Attack needs both honest and byzantine clients, leaving the grads unchanged')
+            return G
+        byz = np.sort(self.rng.choice(n, size=num_byz, replace=False))
+        n_std = self.z_max(n=n, num_byz=num_byz) if self.n_std is None else self.n_std
+
+        # honest average as a GEMV with weights (0 on the byzantine rows) - no copy of the honest rows
+        acc_dtype = np.promote_types(G.dtype, np.float32)
+        w = np.full(n, 1 / (n - num_byz), dtype=acc_dtype)
+        w[byz] = 0
+        for start in range(0, G.shape[1], self.chunk_size):
+            block = G[:, start:start + self.chunk_size]
+            mu = w @ block
+            G[byz, start:start + self.chunk_size] = self.byz_grad(block=block, w=w, mu=mu, n_std=n_std)
+        return G
+
+    @staticmethod
+    def byz_grad(block: np.ndarray, w: np.ndarray, mu: np.ndarray, n_std: float) -> np.ndarray:
         # apply grad corruption = [ \mu - std * \sigma ]
-        byz_grad = grad_mean[:] - self.n_std * grad_std[:]
-        for client in byz_clients:
-            client.grad = byz_grad
+        diff = block - mu
+        np.square(diff, out=diff)
+        sigma = np.sqrt(w @ diff)
+        mu -= n_std * sigma
+        return mu
+
+
+class IPMAttack(DriftAttack):
+    """
+    Inner Product Manipulation :
+    Ref: Xie et.al. "Fall of Empires: Breaking Byzantine-tolerant SGD by Inner Product Manipulation" (UAI 2019)
+    The byzantine rows are set to - epsilon * (mean of the honest rows) so that the aggregate has a negative
+    inner product with the true gradient.
+    """
+
+    def __init__(self, attack_config: Dict, seed=1):
+        DriftAttack.__init__(self, attack_config=attack_config, seed=seed)
+        self.epsilon = attack_config.get("ipm_epsilon", 0.1)
+        self.n_std = 0
+
+    def byz_grad(self, block: np.ndarray, w: np.ndarray, mu: np.ndarray, n_std: float) -> np.ndarray:
+        mu *= - self.epsilon
+        return mu
 
 
 class Additive(ByzAttack):
@@ -86,8 +140,8 @@ class Additive(ByzAttack):
     mean vector and make all the clients grad = mean(grad_i) + noise.
     """
 
-    def __init__(self, attack_config: Dict):
-        ByzAttack.__init__(self, attack_config=attack_config)
+    def __init__(self, attack_config: Dict, seed=1):
+        ByzAttack.__init__(self, attack_config=attack_config, seed=seed)
 
         self.rand_additive_attack_conf = attack_config.get("rand_additive_attack_conf", {})
         print(' Additive Noise Attack {} '.format(self.rand_additive_attack_conf))
@@ -101,21 +155,12 @@ class Additive(ByzAttack):
         # Uniform Noise Model Config
         self.noise_range = self.rand_additive_attack_conf.get("noise_range", [0, 1])
 
-    def attack(self, g):
+    def attack(self, G):
+        # gaussian : G + N(G * mean_shift, attack_std^2) ; uniform : G + U(noise_range)
         if self.noise_dist == 'gaussian':
-            noise = np.random.normal(loc=g*self.mean_shift,
-                                     scale=self.attack_std,
-                                     size=g.shape).astype(dtype=g.dtype)
-
-        elif self.noise_dist == 'uniform':
-            noise_ub = self.noise_range[1]
-            noise_lb = self.noise_range[0]
-            dist = noise_ub - noise_lb
-            noise = np.random.random(g.shape) * dist + noise_lb
-        else:
-            raise NotImplementedError
-
-        return g + noise
+            G *= 1 + self.mean_shift
+        G += self._noise(shape=G.shape, dtype=G.dtype)
+        return G
 
 
 class Random(ByzAttack):
@@ -127,8 +172,8 @@ class Random(ByzAttack):
     drawn randomly from a Normal Distribution with zero mean and specified std
     """
 
-    def __init__(self, attack_config: Dict):
-        ByzAttack.__init__(self, attack_config=attack_config)
+    def __init__(self, attack_config: Dict, seed=1):
+        ByzAttack.__init__(self, attack_config=attack_config, seed=seed)
         self.rand_additive_attack_conf = attack_config.get("rand_additive_attack_conf", {})
         print(' Additive Noise Attack {} '.format(self.rand_additive_attack_conf))
 
@@ -141,21 +186,13 @@ class Random(ByzAttack):
         # Uniform Noise Model Config
         self.noise_range = self.rand_additive_attack_conf.get("noise_range", [0, 1])
 
-    def attack(self, g):
-        # apply gaussian noise (scaled appropriately)
+    def attack(self, G):
+        # apply gaussian noise (scaled appropriately) : N(G * mean_shift, attack_std^2) ; uniform : U(noise_range)
+        noise = self._noise(shape=G.shape, dtype=G.dtype)
         if self.noise_dist == 'gaussian':
-            noise = np.random.normal(loc=g*self.mean_shift,
-                                     scale=self.attack_std,
-                                     size=g.shape).astype(dtype=g.dtype)
-
-        elif self.noise_dist == 'uniform':
-            dist = self.noise_range[1] - self.noise_range[0]
-            min = self.noise_range[0]
-            noise = np.random.random(g.shape) * dist + min
-        else:
-            raise NotImplementedError
-
-        return noise
+            noise += G * self.mean_shift
+        G[:] = noise
+        return G
 
 
 class BitFlipAttack(ByzAttack):
@@ -169,14 +206,15 @@ class BitFlipAttack(ByzAttack):
     Ref: Cong et.al. Zeno: Distributed Stochastic Gradient Descent with Suspicion-based Fault-tolerance (ICML'19).
     """
 
-    def __init__(self, attack_config: Dict):
-        ByzAttack.__init__(self, attack_config=attack_config)
+    def __init__(self, attack_config: Dict, seed=1):
+        ByzAttack.__init__(self, attack_config=attack_config, seed=seed)
         self.sign_flip_conf = self.attack_config.get("sign_flip_conf", {})
         self.flip_scale = self.sign_flip_conf.get("flip_scale", 2)
         print(' Bit flip attack {} '.format(self.sign_flip_conf))
 
-    def attack(self, g):
-        return - self.flip_scale * g
+    def attack(self, G):
+        G *= - self.flip_scale
+        return G
 
 
 class RandomSignFlipAttack(ByzAttack):
@@ -187,16 +225,15 @@ class RandomSignFlipAttack(ByzAttack):
     Ref: Bernstein et.al. SIGNSGD WITH MAJORITY VOTE IS COMMUNICATION EFFICIENT AND FAULT TOLERANT ; (ICLR '19)
     """
 
-    def __init__(self, attack_config: Dict):
-        ByzAttack.__init__(self, attack_config=attack_config)
+    def __init__(self, attack_config: Dict, seed=1):
+        ByzAttack.__init__(self, attack_config=attack_config, seed=seed)
         self.sign_flip_conf = self.attack_config.get("sign_flip_conf", {})
         self.flip_prob = self.sign_flip_conf.get("flip_prob", 0.5)
 
-    def attack(self, g):
-        faulty_grad = np.zeros_like(g)
-        for i in range(0, len(g)):
-            faulty_grad[i] = g[i] if np.random.random() > self.flip_prob else -g[i]
-
-        return faulty_grad
+    def attack(self, G):
+        # each co-ordinate is flipped w.p. flip_prob
+        flip = self.rng.random(size=G.shape, dtype=np.float32) < self.flip_prob
+        np.negative(G, out=G, where=flip)
+        return G
 
 
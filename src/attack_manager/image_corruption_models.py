@@ -1,8 +1,5 @@
 from typing import Dict
 import torch
-import numpy as np
-from skimage.util import random_noise
-from skimage import io
 import matplotlib.pyplot as plt
 
 """
@@ -10,66 +7,91 @@ Implements Image Corruptions as demonstrated by:
 Benchmarking Neural Network Robustness to Common Corruptions and Perturbations 
 (ICLR 2019) by Dan Hendrycks and Thomas Dietterich
 Code: https://github.com/hendrycks/robustness
+
+The noise is applied to a whole batch (or the masked rows of it) at once by in place torch kernels drawing from
+a seeded generator - same model as skimage random_noise on img / 255 clipped to [0, 1] and scaled back by 255.
 """
 
 
+def gaussian_noise_(X: torch.Tensor, var: float, mask=None, generator: torch.Generator = None) -> torch.Tensor:
+    """ In place X[mask] = clip(X[mask] / 255 + N(0, var), 0, 1) * 255 ; mask: (b,) bool - None corrupts all of X """
+    rows = X if mask is None else X[mask]
+    noise = torch.randn(rows.shape, generator=generator, dtype=rows.dtype).to(rows.device)
+    rows.div_(255).add_(noise, alpha=var ** 0.5).clamp_(0, 1).mul_(255)
+    if mask is not None:
+        X[mask] = rows
+    return X
+
+
+def salt_and_pepper_noise_(X: torch.Tensor, amount: float, mask=None,
+                           generator: torch.Generator = None) -> torch.Tensor:
+    """
+    In place : a fraction amount of the pixels of X[mask] is set to 255 (salt) or 0 (pepper) with equal probability,
+    the rest to clip(X[mask] / 255, 0, 1) * 255 ; mask: (b,) bool - None corrupts all of X
+    """
+    rows = X if mask is None else X[mask]
+    # single uniform draw : u < amount flips the pixel, u < amount / 2 makes it salt
+    u = torch.rand(rows.shape, generator=generator).to(rows.device)
+    rows.div_(255).clamp_(0, 1).masked_fill_(u < amount, 0).masked_fill_(u < amount / 2, 1).mul_(255)
+    if mask is not None:
+        X[mask] = rows
+    return X
+
+
 class ImageCorruption:
     """ This is the Base Class for Image Corruptions. """
-    def __init__(self, attack_config: Dict):
+    def __init__(self, attack_config: Dict, seed: int = 1):
         self.attack_config = attack_config
         self.noise_model = self.attack_config.get("noise_model", None)
         self.frac_adv = self.attack_config.get('frac_adv', 0)
         self.sev = attack_config.get('sev', 5)
         self.num_corrupt = 0
         self.curr_corr = 0
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
 
-    def attack(self, X, Y):
+    def attack(self, X, Y, mask=None):
+        """ corrupts the batch X in place ; mask: (b,) bool - corrupt only these samples (None : all) """
         if self.curr_corr > 0:
             # apply attack
-            for ix, sample in enumerate(X):
-                noisy_img = self.corrupt(img=sample)
-                X[ix] = noisy_img
+            X = self.corrupt(X=X, mask=mask)
         return X, Y
 
-    def corrupt(self, img: torch.tensor) -> torch.tensor:
+    def corrupt(self, X: torch.tensor, mask=None) -> torch.tensor:
         raise NotImplementedError
 
 
 class ImageAdditive(ImageCorruption):
-    def __init__(self, attack_config: Dict):
-        ImageCorruption.__init__(self, attack_config=attack_config)
+    def __init__(self, attack_config: Dict, seed: int = 1):
+        ImageCorruption.__init__(self, attack_config=attack_config, seed=seed)
         # self.var = [.08, .12, 0.18, 0.26, 0.38][self.sev - 1]
         self.var = [.01, 0.1, 1, 10, 100][self.sev - 1]
         print(" Additive Image Noise {}".format(self.attack_config))
 
-    def corrupt(self, img):
-        return torch.tensor(np.clip(random_noise(image=img/255., var=self.var), 0, 1) * 255)
+    def corrupt(self, X, mask=None):
+        return gaussian_noise_(X=X, var=self.var, mask=mask, generator=self.generator)
 
 
 class ImageImpulse(ImageCorruption):
-    def __init__(self, attack_config: Dict):
-        ImageCorruption.__init__(self, attack_config=attack_config)
+    def __init__(self, attack_config: Dict, seed: int = 1):
+        ImageCorruption.__init__(self, attack_config=attack_config, seed=seed)
         # self.amount = [.03, .06, .09, 0.17, 0.27][self.sev - 1]
         self.amount = [0.1, 0.25, 0.5, 0.75, 0.95][self.sev - 1]
 
-    def corrupt(self, img: torch.tensor):
-        return torch.tensor(np.clip(random_noise(image=img/255., mode='s&p', amount=self.amount), 0, 1) * 255)
+    def corrupt(self, X, mask=None):
+        return salt_and_pepper_noise_(X=X, amount=self.amount, mask=mask, generator=self.generator)
 
 
 if __name__ == '__main__':
+    from skimage import io
     # Test some noise and visualize
     # Download .png cifar10 command >>"cifar2png cifar10 data"
     sample_im = io.imread('/Users/aa56927-admin/Desktop/BGMD/NeuRips/image_sample.jpeg')
     severity = 5
     # Test and plot noises
-    # noinspection PyArgumentEqualDefault
-    # sample_im = random_noise(image=sample_im, mode='gaussian', var=0.2)
-    # sample_im = random_noise(image=sample_im, mode='poisson')
-    # sample_im = random_noise(image=sample_im, mode='pepper', amount=0.8)
+    # sample_im = gaussian_noise_(X=torch.tensor(sample_im, dtype=torch.float32), var=0.2).numpy()
     c = [.03, .06, .09, 0.17, 0.27][severity - 1]
-    sample_im = random_noise(sample_im / 255., mode='s&p', amount=c)
-    sample_im = np.clip(sample_im, 0, 1) * 255
-    # sample_im = random_noise(image=sample_im, mode='s&p', amount=0.5)
+    sample_im = salt_and_pepper_noise_(X=torch.tensor(sample_im, dtype=torch.float32), amount=c).numpy()
     # sample_im = cv2.GaussianBlur(sample_im, (15, 15), 100)
 
     plt.imshow(sample_im)
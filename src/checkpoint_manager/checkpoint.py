@@ -0,0 +1,118 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import torch
+import numpy as np
+import random
+import shutil
+import os
+from typing import Dict
+
+"""
+Atomic on-disk checkpoints of a training run.
+Each checkpoint is a directory holding state.pt (small state: state dicts, metrics, RNG states ...) and one .npy
+per large array. It is written under a temporary name and renamed into place, after which the `latest`
+pointer file is replaced - a preempted write never corrupts the last complete checkpoint.
+"""
+
+
+class Checkpointer:
+    def __init__(self, checkpoint_dir: str, resume: bool = False, keep: int = 2):
+        """
+        resume: load the latest checkpoint (if any) at the start of training
+        keep: number of most recent checkpoints to keep on disk
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.keep = keep
+        self.saved = []
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def save(self, tag, state: Dict, arrays: Dict = None):
+        """ state: picklable (torch.save) ; arrays: name -> np.ndarray written as .npy (None entries skipped) """
+        name = 'ckpt_{}'.format(tag)
+        path = os.path.join(self.checkpoint_dir, name)
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        torch.save(state, os.path.join(tmp_path, 'state.pt'))
+        for key, arr in (arrays or {}).items():
+            if arr is not None:
+                np.save(os.path.join(tmp_path, key + '.npy'), arr)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        _write_atomic(os.path.join(self.checkpoint_dir, 'latest'), name)
+
+        if name in self.saved:
+            self.saved.remove(name)
+        self.saved.append(name)
+        while len(self.saved) > self.keep:
+            shutil.rmtree(os.path.join(self.checkpoint_dir, self.saved.pop(0)), ignore_errors=True)
+        print('Saved checkpoint {}'.format(path))
+
+    def load(self):
+        """ returns state, arrays (memory mapped, read only) of the latest checkpoint ; None, None if there is none """
+        latest = os.path.join(self.checkpoint_dir, 'latest')
+        if not os.path.exists(latest):
+            return None, None
+        with open(latest) as f:
+            name = f.read().strip()
+        path = os.path.join(self.checkpoint_dir, name)
+        state = torch.load(os.path.join(path, 'state.pt'), weights_only=False)
+        arrays = {file[:-len('.npy')]: np.load(os.path.join(path, file), mmap_mode='r')
+                  for file in os.listdir(path) if file.endswith('.npy')}
+        # checkpoints of the previous runs stay in the rotation
+        self.saved = self._list_saved()
+        print('Loaded checkpoint {}'.format(path))
+        return state, arrays
+
+    def _list_saved(self):
+        """ names of the complete checkpoints in checkpoint_dir, oldest (lowest tag) first """
+        names = [name for name in os.listdir(self.checkpoint_dir) if name.startswith('ckpt_')
+                 and not name.endswith('.tmp') and os.path.isdir(os.path.join(self.checkpoint_dir, name))]
+        # tags are epochs
+        return sorted(names, key=lambda name: (_epoch_tag(name), name))
+
+
+def get_checkpointer(checkpoint_config: Dict, run_id=None):
+    """ wrapper to return a Checkpointer (None if checkpointing is off) ; run_id: ex. seed, gets its own dir """
+    checkpoint_dir = checkpoint_config.get('checkpoint_dir', None)
+    if checkpoint_dir is None:
+        return None
+    if run_id is not None:
+        checkpoint_dir = os.path.join(checkpoint_dir, 'run_{}'.format(run_id))
+    return Checkpointer(checkpoint_dir=checkpoint_dir, resume=checkpoint_config.get('resume', False),
+                        keep=checkpoint_config.get('keep', 2))
+
+
+def get_rng_state() -> Dict:
+    rng_state = {'torch': torch.get_rng_state(),
+                 'numpy': np.random.get_state(),
+                 'random': random.getstate()}
+    if torch.cuda.is_available():
+        rng_state['cuda'] = torch.cuda.get_rng_state_all()
+    return rng_state
+
+
+def set_rng_state(rng_state: Dict):
+    torch.set_rng_state(rng_state['torch'])
+    np.random.set_state(rng_state['numpy'])
+    random.setstate(rng_state['random'])
+    if 'cuda' in rng_state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_state['cuda'])
+
+
+def _epoch_tag(name: str) -> int:
+    tag = name[len('ckpt_'):]
+    return int(tag) if tag.isdigit() else -1
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -31,28 +31,41 @@ class SparseApproxMatrix:
         self.ef = conf.get('ef_server', False)
         print('Error Feedback is: {}'.format(self.ef))
         self.residual_error = 0
+        # residual_error is kept in units of G: it holds r / lr where r is the error (of lr * G) left at the
+        # step with learning rate residual_lr - this keeps reduced precision (float16) storage from underflowing
+        self.residual_lr = 1
         self.normalized_residual = 0
 
     def sparse_approx(self, G: np.ndarray, lr=1) -> [np.ndarray, np.ndarray]:
+        """
+        Works in place on G: G is overwritten by its sparse approximation and returned along with
+        the selected indices I_k (no other n x d matrix is allocated except the error feedback residual).
+        With error feedback this is the sparse approximation of (lr * G + r) / lr, computed as G + r / lr.
+        """
         if self.sampling_rule not in ['active_norm', 'random']:
             raise NotImplementedError
 
         n, d = G.shape
-        G_sparse = np.zeros_like(G)
 
         # for the first run compute k and residual error
         if self.k is None:
             if self.frac > 0:
                 self.k = int(self.frac * d if self.axis == 'dim' else self.frac * n)
-                self.residual_error = np.zeros((n, d), dtype=G[0, :].dtype)
             elif self.frac == 0:
                 self.k = 1
             else:
                 raise ValueError
+            if self.ef is True:
+                self.residual_error = np.zeros((n, d), dtype=G[0, :].dtype)
+                self.residual_lr = lr
             print('Sampling {} coordinates out of {}'.format(self.k, d))
 
         # Error Compensation (if ef is False, residual error = 0 as its not updated
-        G = (lr * G) + self.residual_error
+        if self.ef is True:
+            if self.residual_lr != lr:
+                # rescale to the current lr in place (the residual is overwritten below)
+                self.residual_error *= self.residual_lr / lr
+            G += self.residual_error
 
         # Invoke Sampling algorithm
         if self.sampling_rule == 'active_norm':
@@ -62,18 +75,28 @@ class SparseApproxMatrix:
         else:
             raise NotImplementedError
 
+        # indices not selected - these are zeroed out
+        not_selected = np.ones(G.shape[1 - self.axis], dtype=bool)
+        not_selected[I_k] = False
+        not_selected = np.flatnonzero(not_selected)
+
+        if self.ef is True:
+            # update residual error i.e. the part of G not selected
+            np.copyto(self.residual_error, G)
+            if self.axis == 0:
+                self.residual_error[:, I_k] = 0
+            else:
+                self.residual_error[I_k, :] = 0
+            self.residual_lr = lr
+
         if self.axis == 0:
-            G_sparse[:, I_k] = G[:, I_k]
+            G[:, not_selected] = 0
         elif self.axis == 1:
-            G_sparse[I_k, :] = G[I_k, :]
+            G[not_selected, :] = 0
         else:
             raise ValueError
 
-        if self.ef is True:
-            # update residual error
-            self.residual_error = G - G_sparse
-
-        return G_sparse / lr, I_k
+        return G, I_k
 
     # Implementation of different "Matrix Sparse Approximation" strategies
     def _random_sampling(self, d) -> np.ndarray:
@@ -96,7 +119,9 @@ class SparseApproxMatrix:
         # Exact Implementation ~ O(d log d)
         # norm_dist = G.sum(axis=self.axis)
         # norm_dist = np.square(norm_dist)i
-        norm_dist = np.linalg.norm(G, axis=self.axis)
+        # norms accumulated in (at least) float32 - squares of reduced precision entries underflow
+        norm_dist = np.sqrt(np.einsum('ij,ij->j' if self.axis == 0 else 'ij,ij->i', G, G,
+                                      dtype=np.promote_types(G.dtype, np.float32)))
         norm_dist /= norm_dist.sum()
         sorted_ix = np.argsort(norm_dist)[::-1]
 
@@ -1,4 +1,5 @@
 from .data_manager import *
 from .data_helper import *
 from .vision_datasets import *
+from .tensor_cache import *
 
@@ -6,8 +6,10 @@ from typing import Dict
 from src.agents import FedClient
 import numpy as np
 from typing import List
-from torch.utils.data import DataLoader, Subset
 from src.model_manager import cycle
+from .tensor_cache import get_data_loader, TensorCacheDataset
+import json
+import os
 import torch
 
 torch.manual_seed(1)
@@ -23,9 +25,9 @@ class DataManager:
 
         self.data_config = data_config
         self.data_distribution_map = {}
+        self.norm_stats = {}
 
-    @staticmethod
-    def _get_common_data_trans(_train_dataset):
+    def _get_common_data_trans(self, _train_dataset):
         """ Implements a simple way to compute train and test transform that usually works """
         try:
             mean = [_train_dataset.data.float().mean(axis=(0, 1, 2)) / 255]
@@ -34,12 +36,48 @@ class DataManager:
             mean = _train_dataset.data.mean(axis=(0, 1, 2)) / 255
             std = _train_dataset.data.std(axis=(0, 1, 2)) / 255
 
+        self.norm_stats = {'mean': np.asarray(mean, dtype=np.float64).reshape(-1).tolist(),
+                           'std': np.asarray(std, dtype=np.float64).reshape(-1).tolist()}
         return mean, std
 
     def download_data(self):
         """ Downloads Data and Apply appropriate Transformations . returns train, test dataset """
         raise NotImplementedError("This method needs to be implemented")
 
+    def load_data(self):
+        """
+        download_data served from a preprocessed on disk cache when data_config.cache_dir is set :
+        the first run writes the transformed train / val / test splits as .npy files (and the normalization stats)
+        keyed by dataset and val_frac ; later runs memory map them (TensorCacheDataset) without touching the
+        raw files. returns train, val, test dataset
+        """
+        cache_dir = self.data_config.get('cache_dir', None)
+        if cache_dir is None:
+            return self.download_data()
+
+        key = '{}_val_{}'.format(self.data_config.get('data_set'), self.data_config.get('val_frac', 0))
+        prefixes = [os.path.join(cache_dir, '{}_{}'.format(key, split)) for split in ['train', 'val', 'test']]
+        stats_path = os.path.join(cache_dir, key + '_stats.json')
+
+        if not (os.path.exists(stats_path) and all(TensorCacheDataset.exists(prefix) for prefix in prefixes)):
+            print('Building dataset cache {} in {}'.format(key, cache_dir))
+            os.makedirs(cache_dir, exist_ok=True)
+            for dataset, prefix in zip(self.download_data(), prefixes):
+                if not isinstance(dataset, TensorCacheDataset):
+                    dataset = TensorCacheDataset(dataset=dataset)
+                dataset.save(prefix=prefix)
+            # written last : marks the cache complete (per process tmp file - parallel seeds / sweep jobs may
+            # build the same cache at once)
+            tmp_path = '{}.{}.tmp'.format(stats_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(self.norm_stats, f)
+            os.replace(tmp_path, stats_path)
+
+        with open(stats_path) as f:
+            self.norm_stats = json.load(f)
+        return tuple(TensorCacheDataset.load(prefix=prefix, mmap_mode=self.data_config.get('mmap_mode', 'c'))
+                     for prefix in prefixes)
+
     @staticmethod
     def _iid_sampling(clients: List[FedClient], num_train: int) -> Dict:
         """ Distribute the data iid into all the clients """
@@ -114,12 +152,10 @@ class DataManager:
                 flattened_indices.append(ix)
             flattened_indices = torch.as_tensor(flattened_indices)
 
-            local_dataset = Subset(dataset=train_dataset,
-                                   indices=flattened_indices)
-
-            client.local_train_data = DataLoader(local_dataset,
-                                                 shuffle=True,
-                                                 batch_size=self.data_config.get("batch_size", 256),
-                                                 pin_memory=True,
-                                                 num_workers=self.data_config.get("train_num_workers", 1))
+            client.local_train_data = get_data_loader(dataset=train_dataset,
+                                                      indices=flattened_indices,
+                                                      shuffle=True,
+                                                      batch_size=self.data_config.get("batch_size", 256),
+                                                      pin_memory=True,
+                                                      num_workers=self.data_config.get("train_num_workers", 1))
             client.train_iter = iter(cycle(client.local_train_data))
@@ -0,0 +1,108 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import math
+import os
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader, Subset
+
+"""
+In memory tensor cache of a (transformed) dataset split.
+The per sample transforms (ex. ToTensor + Normalize through PIL) run once over the whole split, after which
+batches are served by a vectorized index gather into contiguous tensors instead of per sample __getitem__.
+A cache can be saved as <prefix>_data.npy / <prefix>_targets.npy and loaded back memory mapped, in which case the
+OS page cache is shared by every process reading the same files.
+"""
+
+
+class TensorCacheDataset(Dataset):
+    def __init__(self, dataset, batch_size: int = 1024):
+        """ Materializes all the (transformed) samples of dataset as contiguous data / targets tensors """
+        data, targets = [], []
+        for x, y in DataLoader(dataset, batch_size=batch_size, shuffle=False):
+            data.append(x)
+            targets.append(torch.as_tensor(y))
+        # (empty split ex. val_frac = 0)
+        self.data = torch.cat(data).contiguous() if data else torch.zeros(0)
+        self.targets = torch.cat(targets).contiguous() if targets else torch.zeros(0, dtype=torch.int64)
+        print('Cached {} samples ({:.1f} MB)'.format(len(self.targets),
+                                                     self.data.element_size() * self.data.nelement() / 2 ** 20))
+
+    @classmethod
+    def from_tensors(cls, data: torch.Tensor, targets: torch.Tensor):
+        cache = cls.__new__(cls)
+        cache.data = data
+        cache.targets = targets
+        return cache
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, ix):
+        """ ix: an index or a batch of indices """
+        return self.data[ix], self.targets[ix]
+
+    def save(self, prefix: str):
+        """
+        writes <prefix>_data.npy and <prefix>_targets.npy (each written to a tmp file then renamed)
+        the tmp files are per process so that concurrent runs building the same cache never interleave writes
+        """
+        for name, tensor in [('data', self.data), ('targets', self.targets)]:
+            path = '{}_{}.npy'.format(prefix, name)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.save(f, tensor.numpy())
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def exists(prefix: str) -> bool:
+        return all(os.path.exists('{}_{}.npy'.format(prefix, name)) for name in ['data', 'targets'])
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: str = 'c'):
+        """
+        Memory maps a saved cache - pages are read lazily and shared across processes.
+        mmap_mode: 'c' (copy on write - in place edits stay private to the process) or 'r' (read only)
+        """
+        data = np.load('{}_data.npy'.format(prefix), mmap_mode=mmap_mode)
+        targets = np.load('{}_targets.npy'.format(prefix), mmap_mode=mmap_mode)
+        return cls.from_tensors(data=torch.from_numpy(data), targets=torch.from_numpy(targets))
+
+
+class TensorCacheLoader:
+    """
+    Drop in for a DataLoader over a TensorCacheDataset (or a subset of it given by indices):
+    every batch is a single index gather
+    """
+
+    def __init__(self, dataset: TensorCacheDataset, batch_size: int = 1, shuffle: bool = False, indices=None):
+        self.cache = dataset
+        # (non iid maps hold lists of shards)
+        self.indices = torch.as_tensor(indices).reshape(-1) if indices is not None else None
+        self.dataset = dataset if indices is None else Subset(dataset=dataset, indices=self.indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return math.ceil(len(self.dataset) / self.batch_size)
+
+    def __iter__(self):
+        n = len(self.dataset)
+        order = torch.randperm(n) if self.shuffle else torch.arange(n)
+        if self.indices is not None:
+            order = self.indices[order]
+        for start in range(0, n, self.batch_size):
+            yield self.cache[order[start:start + self.batch_size]]
+
+
+def get_data_loader(dataset, batch_size: int = 1, shuffle: bool = False, indices=None, **loader_kwargs):
+    """
+    Returns a TensorCacheLoader for cached datasets else a regular DataLoader (over Subset(dataset, indices)
+    if indices are supplied) ; loader_kwargs (ex. num_workers) are only used by the DataLoader
+    """
+    if isinstance(dataset, TensorCacheDataset):
+        return TensorCacheLoader(dataset=dataset, batch_size=batch_size, shuffle=shuffle, indices=indices)
+    if indices is not None:
+        dataset = Subset(dataset=dataset, indices=indices)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **loader_kwargs)
@@ -5,17 +5,31 @@ from src.model_manager import (get_model,
                                get_optimizer,
                                get_scheduler,
                                dist_grads_to_model,
+                               dist_weights_to_model,
                                flatten_grads,
+                               flatten_params,
+                               copy_model,
+                               flatten_batched_grads,
+                               has_batch_norm,
+                               use_flat_params,
+                               GradWorkerPool,
                                get_loss,
-                               evaluate_classifier)
-from src.data_manager import process_data
-from src.aggregation_manager import get_gar, compute_grad_stats
+                               evaluate_classifier,
+                               EvalSubset,
+                               AsyncEvaluator)
+from src.data_manager import process_data, TensorCacheDataset, get_data_loader
+from src.aggregation_manager import get_gar, compute_grad_stats, GradMatrix
 from src.compression_manager import SparseApproxMatrix, get_compression_operator
 from src.attack_manager import get_grad_attack, get_feature_attack
+from src.checkpoint_manager import get_checkpointer, get_rng_state, set_rng_state
+from src.trace_manager import get_tracer, NULL_TRACER
 
 import torch
 from torch.utils.data import DataLoader
+import os
 import time
+import queue
+import threading
 from tqdm import tqdm
 import numpy as np
 
@@ -28,9 +42,24 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 def train_and_test_model(model, criterion, optimizer, lrs, gar,
                          train_loader, test_loader, train_config, metrics,
                          sparse_selection=None, C=None,
-                         grad_attack_model=None, feature_attack_model=None):
+                         grad_attack_model=None, feature_attack_model=None, checkpointer=None):
     num_batches = train_config.get('num_clients', 1)
     log_freq = train_config.get('log_freq', 'epoch')
+    # sequential: one forward / backward per batch ; vmap: all num_clients grads of a round in one batched pass
+    grad_engine = train_config.get('grad_engine', 'sequential')
+    # simulate the workers on a pool of CPU processes
+    parallel_workers = train_config.get('parallel_workers', 0)
+    if parallel_workers > 0:
+        grad_engine = 'pool'
+    if grad_engine in ['vmap', 'pool'] and has_batch_norm(model):
+        print('BatchNorm is not supported by the {} grad engine - falling back to sequential'.format(grad_engine))
+        grad_engine = 'sequential'
+    elif grad_engine not in ['sequential', 'vmap', 'pool']:
+        raise NotImplementedError
+
+    # > 0: compute the next round of grads (on a replica) while the current one is aggregated, the grads
+    # are at most pipeline_staleness steps stale
+    pipeline_staleness = train_config.get('pipeline_staleness', 0)
 
     if feature_attack_model is not None:
         feature_attack_model.num_corrupt = np.ceil(feature_attack_model.frac_adv * num_batches)
@@ -38,123 +67,125 @@ def train_and_test_model(model, criterion, optimizer, lrs, gar,
 
     num_epochs = train_config.get('global_epochs', 10)
 
+    # in between epochs (log_freq: step) evaluate on a fixed stratified sample instead of full passes
+    eval_config = train_config.get('eval_config', {})
+    sample_budget = eval_config.get('sample_budget', 0)
+    eval_sets = {'train': train_loader, 'test': test_loader,
+                 'train_sample': train_loader, 'test_sample': test_loader}
+    if sample_budget > 0 and log_freq == 'step':
+        eval_sets['train_sample'] = EvalSubset(dataset=train_loader.dataset, sample_budget=sample_budget,
+                                               batch_size=test_loader.batch_size, seed=train_config.get('seed', 1))
+        eval_sets['test_sample'] = EvalSubset(dataset=test_loader.dataset, sample_budget=sample_budget,
+                                              batch_size=test_loader.batch_size, seed=train_config.get('seed', 1))
+
+    # evaluate weight snapshots in a background process - the divergence check uses the latest completed result
+    evaluator = None
+    if eval_config.get('async', False):
+        evaluator = AsyncEvaluator(model=model, criterion=criterion, loaders=eval_sets,
+                                   num_threads=eval_config.get('num_threads', 1),
+                                   max_pending=eval_config.get('max_pending', 8))
+
+    # Gradient Matrix: each row is a gradient vector g_i ; allocated once and all stages work on it in place
+    # (single buffer unless grad computation and aggregation overlap)
+    # storage dtype of G and the error feedback residuals: float16 halves their memory / bandwidth,
+    # the GARs accumulate (and return aggregates) in float32
+    grad_storage_dtype = _storage_dtype(train_config.get('grad_storage_dtype', 'float32'))
+    grad_matrix = _init_grad_matrix(num_batches=num_batches, d=sum(w.numel() for w in model.parameters()),
+                                    dtype=grad_storage_dtype, metrics=metrics, num_buffers=pipeline_staleness + 1,
+                                    shared_memory=grad_engine == 'pool')
+    # in reduced precision the first grad of every epoch is also kept in float32 to measure the storage error
+    # (not with the pool engine - the workers write straight into G)
+    storage_ref = None
+    if grad_storage_dtype != np.float32 and grad_engine != 'pool':
+        storage_ref = np.zeros(grad_matrix.d, dtype=np.float32)
+
+    worker_pool = None
+    if grad_engine == 'pool':
+        worker_pool = GradWorkerPool(model=model, criterion=criterion, shared_arena=grad_matrix.shared_arena,
+                                     num_workers=parallel_workers, seed=train_config.get('seed', 1))
+
+    replica = None
+    if pipeline_staleness > 0:
+        print('Pipelined training with staleness {}'.format(pipeline_staleness))
+        replica = copy_model(learner=model.to(device))
+
     epoch = 0
+    if checkpointer is not None and checkpointer.resume:
+        epoch = _load_checkpoint(checkpointer=checkpointer, model=model, optimizer=optimizer, lrs=lrs,
+                                 metrics=metrics, sparse_selection=sparse_selection, C=C,
+                                 feature_attack_model=feature_attack_model,
+                                 grad_attack_model=grad_attack_model, gar=gar)
+    checkpoint_freq = train_config.get('checkpoint_config', {}).get('checkpoint_freq', 1)
+
+    # perf_counter_ns spans of every pipeline stage (no-op unless enabled)
+    trace_config = train_config.get('trace_config', {})
+    tracer = get_tracer(trace_config=trace_config)
 
     while epoch < num_epochs:
         model.to(device)
         model.train()
-        G = None
-        epoch_grad_cost = 0
+        epoch_costs = {"grad": 0, "wait": 0}
         epoch_agg_cost = 0
+        epoch_agg_bytes = 0
         epoch_gm_iter = 0
         epoch_sparse_cost = 0
+        t_epoch = time.time()
+        t_epoch_ns = time.perf_counter_ns()
 
         # ------- Training Phase --------- #
         print('epoch {}/{} || learning rate: {}'.format(epoch, num_epochs, optimizer.param_groups[0]['lr']))
         p_bar = tqdm(total=len(train_loader))
         p_bar.set_description("Epoch Progress: ")
 
-        for batch_ix, (images, labels) in enumerate(train_loader):
-            metrics["num_iter"] += 1
-            t_iter = time.time()
-
-            # Apply Feature Attack
-            if feature_attack_model is not None:
-                images, labels = feature_attack_model.attack(X=images, Y=labels)
-                feature_attack_model.curr_corr -= 1
-
-            images = images.to(device)
-            labels = labels.to(device)
-            outputs = model(images)
-            optimizer.zero_grad()
-            loss = criterion(outputs, labels)
-            loss.backward()
-            # Note: No Optimizer Step yet.
-
-            g_i = flatten_grads(learner=model)
-            if G is None:
-                d = len(g_i)
-                print("Num of Parameters {}".format(d))
-                metrics["num_param"] = d
-                G = np.zeros((num_batches, d), dtype=g_i.dtype)
-
-            ix = batch_ix % num_batches
-            agg_ix = (batch_ix + 1) % num_batches
-            G[ix, :] = g_i
-
-            iteration_time = time.time() - t_iter
-            epoch_grad_cost += iteration_time
-            p_bar.update()
-
-            if agg_ix == 0 and batch_ix is not 0:
-                # Adversarial Attack
-                if grad_attack_model is not None:
-                    G = grad_attack_model.launch_attack(G=G)
-                if feature_attack_model is not None:
-                    # Reset For next set of batches
-                    feature_attack_model.curr_corr = feature_attack_model.num_corrupt
-
-                    # Compress each vector before aggregation
-                lr = optimizer.param_groups[0]['lr']  # Need this for Error Feedback
-
-                if C is not None:
-                    residual = 0
-                    for ix, g_i in enumerate(G):
-                        compressed_grad = C.compress(g_i, lr=lr)
-                        # Track SE
-                        residual += np.linalg.norm(g_i - compressed_grad)
-                        G[ix, :] = compressed_grad
-
-                    # Compute MSE
-                    residual /= len(G)
-                    # print("Residual Due to Communication Compression {}".format(residual))
-                    metrics["communication_residual"].append(residual)
-                
-                # --- Gradient Aggregation Step -------- ###
-                # Sparse Approximation of G
-                I_k = None
-                if sparse_selection is not None:
-                    t0 = time.time()
-                    G, I_k = sparse_selection.sparse_approx(G=G, lr=lr)
-                    epoch_sparse_cost += time.time() - t0
-                    metrics["sparse_approx_residual"].append(sparse_selection.normalized_residual)
-
-                # Gradient aggregation
-                agg_g = gar.aggregate(G=G, ix=I_k)
-
-                epoch_gm_iter += gar.num_iter
-                epoch_agg_cost += gar.agg_time
-
-                # Reset GAR stats
-                gar.agg_time = 0
-                gar.num_iter = 0
-
-                # Update Model Grads with aggregated g : i.e. compute \tilde(g)
-                optimizer.zero_grad()
-                dist_grads_to_model(grads=agg_g, learner=model)
-                model.to(device)
-                # Now Do an optimizer step with x_t+1 = x_t - \eta \tilde(g)
-                optimizer.step()
-
-                metrics["num_steps"] += 1
-
-                if log_freq == 'step':
-                    train_loss = evaluate_classifier(model=model, train_loader=train_loader, test_loader=test_loader,
-                                                     metrics=metrics, criterion=criterion, device=device,
-                                                     epoch=epoch, num_epochs=num_epochs, train_metric=True,
-                                                     test_metric=False)
-                    # Stop if diverging
-                    if (train_loss > 1e3) | np.isnan(train_loss) | np.isinf(train_loss):
-                        epoch = num_epochs
-                        print(" *** Training is Diverging - Stopping !!! *** ")
+        if replica is None:
+            grad_rounds = _grad_rounds(model=model, criterion=criterion, train_loader=train_loader,
+                                       grad_matrix=grad_matrix, grad_engine=grad_engine, worker_pool=worker_pool,
+                                       num_batches=num_batches, metrics=metrics,
+                                       feature_attack_model=feature_attack_model,
+                                       begin_round=lambda: grad_matrix.curr, costs=epoch_costs, p_bar=p_bar,
+                                       storage_ref=storage_ref, tracer=tracer)
+        else:
+            grad_rounds = _pipelined_grad_rounds(model=model, replica=replica, criterion=criterion,
+                                                 train_loader=train_loader, grad_matrix=grad_matrix,
+                                                 grad_engine=grad_engine, worker_pool=worker_pool,
+                                                 num_batches=num_batches, metrics=metrics,
+                                                 feature_attack_model=feature_attack_model,
+                                                 costs=epoch_costs, p_bar=p_bar, storage_ref=storage_ref,
+                                                 tracer=tracer)
+
+        for buffer_ix in grad_rounds:
+            sparse_cost, agg_cost, gm_iter, agg_bytes = _aggregate_and_step(G=grad_matrix.buffer(buffer_ix),
+                                                                            model=model, optimizer=optimizer,
+                                                                            gar=gar, metrics=metrics,
+                                                                            sparse_selection=sparse_selection, C=C,
+                                                                            grad_attack_model=grad_attack_model,
+                                                                            tracer=tracer)
+            epoch_sparse_cost += sparse_cost
+            epoch_agg_cost += agg_cost
+            epoch_agg_bytes += agg_bytes
+            epoch_gm_iter += gm_iter
+
+            if log_freq == 'step':
+                train_loss = _evaluate_model(model=model, criterion=criterion, metrics=metrics, epoch=epoch,
+                                             num_epochs=num_epochs, eval_sets=eval_sets, evaluator=evaluator,
+                                             sampled=True, test_metric=sample_budget > 0, tracer=tracer)
+                # Stop if diverging
+                if (train_loss > 1e3) | np.isnan(train_loss) | np.isinf(train_loss):
+                    epoch = num_epochs
+                    print(" *** Training is Diverging - Stopping !!! *** ")
 
         p_bar.close()
+        if replica is not None:
+            # running stats (ex. BatchNorm) are tracked by the replica
+            for b, b_replica in zip(model.buffers(), replica.buffers()):
+                b.data.copy_(b_replica.data)
         if lrs is not None:
             lrs.step()
+        tracer.record('epoch', t_epoch_ns, epoch=epoch)
 
-        train_loss = evaluate_classifier(model=model, train_loader=train_loader, test_loader=test_loader,
-                                         metrics=metrics, criterion=criterion, device=device,
-                                         epoch=epoch, num_epochs=num_epochs)
+        train_loss = _evaluate_model(model=model, criterion=criterion, metrics=metrics, epoch=epoch,
+                                     num_epochs=num_epochs, eval_sets=eval_sets, evaluator=evaluator,
+                                     tracer=tracer)
         # Stop if diverging
         if (train_loss > 1e3) | np.isnan(train_loss) | np.isinf(train_loss):
             epoch = num_epochs
@@ -162,11 +193,16 @@ def train_and_test_model(model, criterion, optimizer, lrs, gar,
 
         epoch += 1
         # update Epoch Complexity metrics
-        print("Epoch Grad Cost: {}".format(epoch_grad_cost))
-        metrics["epoch_grad_cost"].append(epoch_grad_cost)
+        print("Epoch Grad Cost: {}".format(epoch_costs["grad"]))
+        metrics["epoch_grad_cost"].append(epoch_costs["grad"])
 
         print("Epoch Aggregation Cost: {}".format(epoch_agg_cost))
         metrics["epoch_agg_cost"].append(epoch_agg_cost)
+        # achieved bandwidth : bytes of G read / aggregation time, counting one pass over G (or its block) per
+        # aggregation and per iteration of iterative GARs (GM)
+        epoch_agg_gbps = epoch_agg_bytes / epoch_agg_cost / 1e9 if epoch_agg_cost > 0 else 0
+        print("Epoch Aggregation Throughput: {:.2f} GB/s (one pass over G per GAR iteration)".format(epoch_agg_gbps))
+        metrics["epoch_agg_gbps"].append(epoch_agg_gbps)
 
         print("Epoch GM iterations: {}".format(epoch_gm_iter))
         metrics["epoch_gm_iter"].append(epoch_gm_iter)
@@ -174,6 +210,32 @@ def train_and_test_model(model, criterion, optimizer, lrs, gar,
         print("Epoch Sparse Approx Cost: {}".format(epoch_sparse_cost))
         metrics["epoch_sparse_approx_cost"].append(epoch_sparse_cost)
 
+        print("Epoch Pipeline Wait Cost: {}".format(epoch_costs["wait"]))
+        metrics["epoch_pipeline_wait_cost"].append(epoch_costs["wait"])
+
+        print("Epoch Train Time: {}".format(time.time() - t_epoch))
+        metrics["epoch_train_time"].append(time.time() - t_epoch)
+
+        if checkpointer is not None and (epoch % checkpoint_freq == 0 or epoch >= num_epochs):
+            if evaluator is not None:
+                evaluator.record(metrics=metrics, block=True)
+            with tracer.span('checkpoint'):
+                _save_checkpoint(checkpointer=checkpointer, epoch=epoch, model=model, optimizer=optimizer, lrs=lrs,
+                                 metrics=metrics, sparse_selection=sparse_selection, C=C,
+                                 feature_attack_model=feature_attack_model,
+                                 grad_attack_model=grad_attack_model, gar=gar)
+
+    if worker_pool is not None:
+        worker_pool.close()
+    gar.close()
+    if evaluator is not None:
+        evaluator.close(metrics=metrics)
+    if tracer is not NULL_TRACER:
+        tracer.print_summary()
+        metrics["trace_summary"] = tracer.summary()
+        if trace_config.get('trace_dir', None) is not None:
+            tracer.export_chrome_trace(path=os.path.join(trace_config['trace_dir'], 'trace.json'))
+
     # Update Total Complexities
     metrics["total_grad_cost"] = sum(metrics["epoch_grad_cost"])
     metrics["total_agg_cost"] = sum(metrics["epoch_agg_cost"])
@@ -186,6 +248,355 @@ def train_and_test_model(model, criterion, optimizer, lrs, gar,
         metrics["avg_gm_cost"] = metrics["total_agg_cost"] / metrics["total_gm_iter"]
 
 
+def _save_checkpoint(checkpointer, epoch, model, optimizer, lrs, metrics, sparse_selection=None, C=None,
+                     feature_attack_model=None, grad_attack_model=None, gar=None):
+    """ Saves all the state needed to continue (bit-for-bit) the run from the start of epoch """
+    state = {"epoch": epoch,
+             "model": model.state_dict(),
+             "optimizer": optimizer.state_dict(),
+             "lrs": lrs.state_dict() if lrs is not None else None,
+             "metrics": {key: val for key, val in metrics.items() if key != "config"},
+             "rng_state": get_rng_state(),
+             "sparse_k": sparse_selection.k if sparse_selection is not None else None,
+             "sparse_residual_lr": sparse_selection.residual_lr if sparse_selection is not None else None,
+             "feature_attack_curr_corr": feature_attack_model.curr_corr if feature_attack_model is not None
+             else None,
+             "feature_attack_rng": feature_attack_model.generator.get_state() if feature_attack_model is not None
+             else None,
+             "grad_attack_rng": grad_attack_model.rng.bit_generator.state if grad_attack_model is not None
+             else None}
+    arrays = {}
+    if gar is not None:
+        # (ex. GM warm start)
+        state["gar"], gar_arrays = gar.get_state()
+        arrays.update({"gar_" + key: val for key, val in gar_arrays.items()})
+    if sparse_selection is not None and isinstance(sparse_selection.residual_error, np.ndarray):
+        arrays["sparse_residual_error"] = sparse_selection.residual_error
+    if C is not None and isinstance(C.residual_error, np.ndarray):
+        arrays["compression_residual_error"] = C.residual_error
+    checkpointer.save(tag=epoch, state=state, arrays=arrays)
+
+
+def _load_checkpoint(checkpointer, model, optimizer, lrs, metrics, sparse_selection=None, C=None,
+                     feature_attack_model=None, grad_attack_model=None, gar=None) -> int:
+    """ Restores the state saved by _save_checkpoint ; returns the epoch to continue from (0 if no checkpoint) """
+    state, arrays = checkpointer.load()
+    if state is None:
+        return 0
+    # load_state_dict copies in place - flat param views (if any) stay bound
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    if lrs is not None:
+        lrs.load_state_dict(state["lrs"])
+    metrics.update(state["metrics"])
+    if sparse_selection is not None:
+        sparse_selection.k = state["sparse_k"]
+        sparse_selection.residual_lr = state["sparse_residual_lr"]
+        if "sparse_residual_error" in arrays:
+            sparse_selection.residual_error = np.array(arrays["sparse_residual_error"])
+    if C is not None and "compression_residual_error" in arrays:
+        C.residual_error = np.array(arrays["compression_residual_error"])
+    if feature_attack_model is not None:
+        feature_attack_model.curr_corr = state["feature_attack_curr_corr"]
+        feature_attack_model.generator.set_state(state["feature_attack_rng"])
+    if grad_attack_model is not None:
+        grad_attack_model.rng.bit_generator.state = state["grad_attack_rng"]
+    if gar is not None:
+        gar.set_state(state=state["gar"], arrays={key[len("gar_"):]: val for key, val in arrays.items()
+                                                  if key.startswith("gar_")})
+    set_rng_state(state["rng_state"])
+    print('Resuming from epoch {}'.format(state["epoch"]))
+    return state["epoch"]
+
+
+def _evaluate_model(model, criterion, metrics, epoch, num_epochs, eval_sets, evaluator=None,
+                    sampled=False, test_metric=True, tracer=NULL_TRACER) -> float:
+    """
+    Evaluates on the full (or sampled) train / test sets, in the background if an evaluator is supplied.
+    returns the train loss ; with an evaluator the most recent completed one (0 if there is none yet)
+    """
+    train_set, test_set = ('train_sample', 'test_sample') if sampled else ('train', 'test')
+    with tracer.span('evaluation', sampled=sampled, background=evaluator is not None):
+        if evaluator is None:
+            return evaluate_classifier(model=model, train_loader=eval_sets[train_set],
+                                       test_loader=eval_sets[test_set], metrics=metrics, criterion=criterion,
+                                       device=device, epoch=epoch, num_epochs=num_epochs, test_metric=test_metric)
+        evaluator.submit(model=model, metrics=metrics, epoch=epoch, num_epochs=num_epochs, train_loader=train_set,
+                         test_loader=test_set, test_metric=test_metric)
+        train_loss = evaluator.record(metrics=metrics)
+    return 0 if train_loss is None else train_loss
+
+
+def _grad_rounds(model, criterion, train_loader, grad_matrix, grad_engine, worker_pool, num_batches, metrics,
+                 feature_attack_model, begin_round, costs, p_bar, storage_ref=None, tracer=NULL_TRACER):
+    """
+    Iterates over the train loader computing the grads of every num_batches batches (a round) as rows of a
+    buffer of grad_matrix. Yields the buffer ix once the round is complete.
+    begin_round: returns the buffer ix to write the next round into
+    storage_ref: (d,) float32 - the first grad is also computed into it to measure the error of storing G in
+    reduced precision (recorded in grad_storage_rel_error)
+    """
+    round_images, round_labels = [], []
+    buffer_ix = None
+    t_data_ns = time.perf_counter_ns()
+
+    for batch_ix, (images, labels) in enumerate(train_loader):
+        tracer.record('data', t_data_ns)
+        metrics["num_iter"] += 1
+        t_iter = time.time()
+
+        # Apply Feature Attack
+        if feature_attack_model is not None:
+            with tracer.span('feature_attack'):
+                images, labels = feature_attack_model.attack(X=images, Y=labels)
+            feature_attack_model.curr_corr -= 1
+
+        ix = batch_ix % num_batches
+        agg_ix = (batch_ix + 1) % num_batches
+
+        if grad_engine == 'sequential':
+            if buffer_ix is None:
+                buffer_ix = begin_round()
+            with tracer.span('grad'):
+                _compute_grad(model=model, criterion=criterion, images=images, labels=labels,
+                              out=grad_matrix.buffer(buffer_ix)[ix, :] if storage_ref is None else storage_ref)
+            if storage_ref is not None:
+                _check_storage_precision(ref=storage_ref, g=grad_matrix.buffer(buffer_ix)[ix, :], metrics=metrics)
+                storage_ref = None
+        else:
+            # defer grad computation till the round is complete
+            round_images.append(images)
+            round_labels.append(labels)
+
+        iteration_time = time.time() - t_iter
+        costs["grad"] += iteration_time
+        p_bar.update()
+
+        if agg_ix == 0 and batch_ix is not 0:
+            if grad_engine != 'sequential':
+                buffer_ix = begin_round()
+                t0 = time.time()
+                with tracer.span('grad', engine=grad_engine):
+                    if grad_engine == 'vmap':
+                        _compute_round_grads(model=model, criterion=criterion,
+                                             round_images=round_images[-num_batches:],
+                                             round_labels=round_labels[-num_batches:],
+                                             out=grad_matrix.buffer(buffer_ix), ref=storage_ref)
+                    else:
+                        worker_pool.compute_grads(model=model, round_images=round_images[-num_batches:],
+                                                  round_labels=round_labels[-num_batches:], buffer_ix=buffer_ix)
+                round_images, round_labels = [], []
+                costs["grad"] += time.time() - t0
+                if storage_ref is not None and grad_engine == 'vmap':
+                    _check_storage_precision(ref=storage_ref, g=grad_matrix.buffer(buffer_ix)[0, :], metrics=metrics)
+                    storage_ref = None
+
+            if feature_attack_model is not None:
+                # Reset For next set of batches
+                feature_attack_model.curr_corr = feature_attack_model.num_corrupt
+
+            yield buffer_ix
+            buffer_ix = None
+
+        t_data_ns = time.perf_counter_ns()
+
+
+def _pipelined_grad_rounds(model, replica, criterion, train_loader, grad_matrix, grad_engine, worker_pool,
+                           num_batches, metrics, feature_attack_model, costs, p_bar, storage_ref=None,
+                           tracer=NULL_TRACER):
+    """
+    Same as _grad_rounds but the grads are computed on a replica of the model in a background thread, so the
+    next rounds are computed while the current one is aggregated. With s = num_buffers - 1, round k of the epoch
+    is always computed with the weights after step k - s (the weights at the start of the epoch for k < s), so the
+    grads are exactly s steps stale and the run does not depend on thread timing.
+    """
+    # each buffer travels with the weights its next round is computed with : the weights published when the
+    # buffer is recycled after step j are the ones round j + s begins with
+    weights = [flatten_params(learner=model) for _ in range(grad_matrix.num_buffers)]
+    free_buffers = queue.Queue()
+    for buffer_ix in range(grad_matrix.num_buffers):
+        free_buffers.put(buffer_ix)
+    ready_buffers = queue.Queue()
+    errors = []
+
+    def begin_round():
+        with tracer.span('pipeline_stall'):
+            buffer_ix = free_buffers.get()
+        dist_weights_to_model(weights=weights[buffer_ix], learner=replica)
+        replica.to(device)
+        return buffer_ix
+
+    def produce():
+        try:
+            replica.train()
+            for buffer_ix in _grad_rounds(model=replica, criterion=criterion, train_loader=train_loader,
+                                          grad_matrix=grad_matrix, grad_engine=grad_engine,
+                                          worker_pool=worker_pool, num_batches=num_batches, metrics=metrics,
+                                          feature_attack_model=feature_attack_model, begin_round=begin_round,
+                                          costs=costs, p_bar=p_bar, storage_ref=storage_ref, tracer=tracer):
+                ready_buffers.put(buffer_ix)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            ready_buffers.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    while True:
+        t0 = time.time()
+        with tracer.span('pipeline_wait'):
+            buffer_ix = ready_buffers.get()
+        costs["wait"] += time.time() - t0
+        if buffer_ix is None:
+            break
+        yield buffer_ix
+        # round is aggregated - recycle the buffer along with the updated weights
+        flatten_params(learner=model, out=weights[buffer_ix])
+        free_buffers.put(buffer_ix)
+
+    producer.join()
+    if errors:
+        raise errors[0]
+
+
+def _aggregate_and_step(G, model, optimizer, gar, metrics, sparse_selection=None, C=None, grad_attack_model=None,
+                        tracer=NULL_TRACER):
+    """
+    Runs the aggregation pipeline on G in place: attack -> compression -> sparse approximation -> GAR
+    and takes an optimizer step with the aggregated gradient.
+    returns sparse approximation cost, aggregation cost, GM iterations, bytes of G read by the GAR
+    """
+    t_step_ns = time.perf_counter_ns()
+    # Adversarial Attack
+    if grad_attack_model is not None:
+        with tracer.span('grad_attack'):
+            G = grad_attack_model.launch_attack(G=G)
+
+    # Compress each vector before aggregation
+    lr = optimizer.param_groups[0]['lr']  # Need this for Error Feedback
+
+    if C is not None:
+        with tracer.span('compression'):
+            residual = 0
+            for g_i in G:
+                compressed_grad = C.compress(g_i, lr=lr)
+                if compressed_grad is g_i:
+                    # no compression
+                    continue
+                # Track SE
+                residual += np.linalg.norm(g_i - compressed_grad)
+                g_i[:] = compressed_grad
+
+            # Compute MSE
+            residual /= len(G)
+        # print("Residual Due to Communication Compression {}".format(residual))
+        metrics["communication_residual"].append(residual)
+
+    # --- Gradient Aggregation Step -------- ###
+    # Sparse Approximation of G
+    I_k = None
+    sparse_cost = 0
+    if sparse_selection is not None:
+        t0 = time.time()
+        with tracer.span('sparse_approx'):
+            G, I_k = sparse_selection.sparse_approx(G=G, lr=lr)
+        sparse_cost = time.time() - t0
+        metrics["sparse_approx_residual"].append(sparse_selection.normalized_residual)
+
+    # Gradient aggregation
+    gar.lr = lr
+    with tracer.span('gar'):
+        agg_g = gar.aggregate(G=G, ix=I_k)
+    # model grads are float32 (no copy unless G is stored in reduced precision)
+    agg_g = np.asarray(agg_g, dtype=np.float32)
+
+    agg_cost, gm_iter = gar.agg_time, gar.num_iter
+    # iterative GARs (GM) read G once per iteration
+    agg_bytes = G.shape[0] * (len(I_k) if I_k is not None else G.shape[1]) * G.itemsize * max(gm_iter, 1)
+    if gar.iter_saved > 0:
+        # (warm started GM) estimated at the cost per iteration of this round
+        metrics["total_gm_iter_saved"] += gar.iter_saved
+        metrics["total_gm_time_saved"] += gar.iter_saved * agg_cost / max(gm_iter, 1)
+    # Reset GAR stats
+    gar.agg_time = 0
+    gar.num_iter = 0
+    gar.iter_saved = 0
+
+    # Update Model Grads with aggregated g : i.e. compute \tilde(g)
+    with tracer.span('dist_grads_to_model'):
+        optimizer.zero_grad()
+        dist_grads_to_model(grads=agg_g, learner=model)
+        model.to(device)
+    # Now Do an optimizer step with x_t+1 = x_t - \eta \tilde(g)
+    with tracer.span('optimizer_step'):
+        optimizer.step()
+
+    metrics["num_steps"] += 1
+    tracer.record('step', t_step_ns, step=metrics["num_steps"])
+    return sparse_cost, agg_cost, gm_iter, agg_bytes
+
+
+def _compute_grad(model, criterion, images, labels, out: np.ndarray = None) -> np.ndarray:
+    """ Regular forward / backward on a single batch ; returns the flattened grad (written into out if supplied) """
+    images = images.to(device)
+    labels = labels.to(device)
+    outputs = model(images)
+    # flat models zero their grads in place to keep them as views into the flat buffer
+    model.zero_grad(set_to_none=getattr(model, 'flat_params', None) is None)
+    loss = criterion(outputs, labels)
+    loss.backward()
+    # Note: No Optimizer Step yet.
+    return flatten_grads(learner=model, out=out)
+
+
+def _compute_round_grads(model, criterion, round_images, round_labels, out: np.ndarray, ref: np.ndarray = None):
+    """
+    Computes the grads of all the batches of a round in one vectorized pass, written as rows of out.
+    If the batches are of unequal size (ex. last batch of the epoch) they can't be stacked -
+    fall back to one forward / backward per batch.
+    ref: if supplied the first grad is also written into it at full precision
+    """
+    if len(set(images.shape for images in round_images)) == 1:
+        images = torch.stack(round_images).to(device)
+        labels = torch.stack(round_labels).to(device)
+        grads = flatten_batched_grads(learner=model, criterion=criterion, images=images, labels=labels)
+        out[:, :] = grads
+        if ref is not None:
+            ref[:] = grads[0]
+        return
+
+    for ix, (images, labels) in enumerate(zip(round_images, round_labels)):
+        _compute_grad(model=model, criterion=criterion, images=images, labels=labels,
+                      out=ref if ix == 0 and ref is not None else out[ix, :])
+        if ix == 0 and ref is not None:
+            out[ix, :] = ref
+
+
+def _check_storage_precision(ref: np.ndarray, g: np.ndarray, metrics):
+    """ stores the full precision grad ref in g (a row of G) and records the relative error due to storage """
+    g[:] = ref
+    rel_error = float(np.linalg.norm(ref - g) / max(np.linalg.norm(ref), 1e-12))
+    print('Grad storage ({}) relative error: {}'.format(g.dtype, rel_error))
+    metrics["grad_storage_rel_error"].append(rel_error)
+
+
+def _storage_dtype(grad_storage_dtype: str):
+    if grad_storage_dtype == 'float32':
+        return np.float32
+    elif grad_storage_dtype == 'float16':
+        return np.float16
+    else:
+        # ex. bfloat16: numpy has no native bfloat16 (all the stages work on numpy arrays)
+        raise NotImplementedError
+
+
+def _init_grad_matrix(num_batches, d, dtype, metrics, num_buffers=2, shared_memory=False) -> GradMatrix:
+    print("Num of Parameters {}".format(d))
+    metrics["num_param"] = d
+    return GradMatrix(n=num_batches, d=d, dtype=dtype, num_buffers=num_buffers, shared_memory=shared_memory)
+
+
 def run_batch_train(config, metrics, seed):
     # ------------------------ Fetch configs ----------------------- #
     print('---- Fetching configs -----')
@@ -211,19 +622,27 @@ def run_batch_train(config, metrics, seed):
     # ------------------------- get data --------------------- #
     batch_size = data_config.get('batch_size', 1)
     data_manager = process_data(data_config=data_config)
-    train_dataset, val_dataset, test_dataset = data_manager.download_data()
+    train_dataset, val_dataset, test_dataset = data_manager.load_data()
+
+    if data_config.get('cache_tensors', False) and not isinstance(train_dataset, TensorCacheDataset):
+        # transform the splits once - batches are then served by index gather
+        train_dataset = TensorCacheDataset(dataset=train_dataset)
+        test_dataset = TensorCacheDataset(dataset=test_dataset)
 
-    train_loader = DataLoader(dataset=train_dataset, batch_size=batch_size, shuffle=True)
+    train_loader = get_data_loader(dataset=train_dataset, batch_size=batch_size, shuffle=True)
     print('Num of Batches in Train Loader = {}'.format(len(train_loader)))
-    test_loader = DataLoader(dataset=test_dataset, batch_size=batch_size)
+    test_loader = get_data_loader(dataset=test_dataset, batch_size=batch_size)
 
     # Apply Data Corruption to train data -
     # Both corruption to X and Label
-    feature_attack_model = get_feature_attack(attack_config=feature_attack_config)
+    feature_attack_model = get_feature_attack(attack_config=feature_attack_config, seed=seed)
     # feature_attack_model.launch_attack(data_loader=train_loader)
 
     # ------------------------- Initializations --------------------- #
     client_model = get_model(learner_config=learner_config, data_config=data_config, seed=seed)
+    if learner_config.get('flat_params', False):
+        # keep all params / grads in one contiguous buffer
+        use_flat_params(learner=client_model.to(device))
     client_optimizer = get_optimizer(params=client_model.parameters(), optimizer_config=client_optimizer_config)
     client_lrs = get_scheduler(optimizer=client_optimizer, lrs_config=client_lrs_config)
     criterion = get_loss(loss=client_optimizer_config.get('loss', 'ce'))
@@ -236,15 +655,18 @@ def run_batch_train(config, metrics, seed):
     sparse_selection = SparseApproxMatrix(conf=sparse_approx_config) if sparse_rule in ['active_norm', 'random'] \
         else None
     # for adversarial - get attack model
-    grad_attack_model = get_grad_attack(attack_config=grad_attack_config)
+    grad_attack_model = get_grad_attack(attack_config=grad_attack_config, seed=seed)
     # gradient compression object
     C = get_compression_operator(compression_config=compression_config)
 
+    # periodic checkpoints (one dir per seed) to resume from
+    checkpointer = get_checkpointer(checkpoint_config=training_config.get('checkpoint_config', {}), run_id=seed)
+
     # ------------------------- Run Training --------------------- #
     train_and_test_model(model=client_model, criterion=criterion, optimizer=client_optimizer, lrs=client_lrs,
                          gar=gar, sparse_selection=sparse_selection, C=C,
                          grad_attack_model=grad_attack_model, feature_attack_model=feature_attack_model,
                          train_loader=train_loader, test_loader=test_loader,
-                         metrics=metrics, train_config=training_config)
+                         metrics=metrics, train_config=training_config, checkpointer=checkpointer)
 
     return metrics
@@ -6,16 +6,23 @@ from src.model_manager import (get_model,
                                get_scheduler,
                                take_lrs_step,
                                get_loss,
-                               evaluate_classifier)
-from src.data_manager import process_data
+                               evaluate_classifier,
+                               EvalSubset,
+                               AsyncEvaluator)
+from src.data_manager import process_data, TensorCacheDataset, get_data_loader
 from src.aggregation_manager import get_gar
 from src.agents import FedServer, FedClient
 from src.compression_manager import get_compression_operator
+from src.attack_manager import get_grad_attack
+from src.trace_manager import get_tracer, NULL_TRACER
 
+import numpy as np
 import torch
 from typing import List, Dict
 import copy
+import os
 import random
+import time
 import math
 from torch.utils.data import DataLoader
 
@@ -54,8 +61,7 @@ def train_clients(server: FedServer,
     # print("Epoch Loss : {}".format(epoch_loss))
 
     # At this point we have all the g_i computed
-    # Apply Attack (Here since we can also apply co-ordinated attack)
-    # TODO: Incorporate attacks
+    # The attack is applied by the server on the stacked grads (so that it can also be co-ordinated)
 
 
 def train_and_test_model(server: FedServer,
@@ -70,13 +76,17 @@ def train_and_test_model(server: FedServer,
     print('# ------------------------------------------------- #')
     # Get Data
     data_manager = process_data(data_config=data_config)
-    train_dataset, test_dataset = data_manager.download_data()
+    train_dataset, _, test_dataset = data_manager.load_data()
+    if data_config.get('cache_tensors', False) and not isinstance(train_dataset, TensorCacheDataset):
+        # transform the splits once - batches are then served by index gather
+        train_dataset = TensorCacheDataset(dataset=train_dataset)
+        test_dataset = TensorCacheDataset(dataset=test_dataset)
 
     # Distribute Data among clients
     data_manager.distribute_data(train_dataset=train_dataset, clients=clients)
 
-    train_loader = DataLoader(dataset=train_dataset, batch_size=128)
-    test_loader = DataLoader(dataset=test_dataset, batch_size=len(test_dataset))
+    train_loader = get_data_loader(dataset=train_dataset, batch_size=128)
+    test_loader = get_data_loader(dataset=test_dataset, batch_size=len(test_dataset))
 
     print('# ------------------------------------------------- #')
     print('#            Launching Federated Training           #')
@@ -86,8 +96,31 @@ def train_and_test_model(server: FedServer,
     local_epochs = training_config.get('local_epochs', 1)
     Q = training_config.get('Q', 1)
 
+    # evaluate on a fixed stratified sample except at the last round (full pass)
+    eval_config = training_config.get('eval_config', {})
+    sample_budget = eval_config.get('sample_budget', 0)
+    eval_sets = {'train': train_loader, 'test': test_loader,
+                 'train_sample': train_loader, 'test_sample': test_loader}
+    if sample_budget > 0:
+        eval_sets['train_sample'] = EvalSubset(dataset=train_dataset, sample_budget=sample_budget, batch_size=128)
+        eval_sets['test_sample'] = EvalSubset(dataset=test_dataset, sample_budget=sample_budget, batch_size=128)
+
+    # evaluate weight snapshots of the server model in a background process
+    evaluator = None
+    if eval_config.get('async', False):
+        evaluator = AsyncEvaluator(model=server.learner, criterion=clients[0].criterion, loaders=eval_sets,
+                                   num_threads=eval_config.get('num_threads', 1),
+                                   max_pending=eval_config.get('max_pending', 8))
+
+    # perf_counter_ns spans of the server / client steps (no-op unless enabled)
+    trace_config = training_config.get('trace_config', {})
+    tracer = get_tracer(trace_config=trace_config)
+    for agent in [server] + clients:
+        agent.tracer = tracer
+
     for comm_round in range(1, global_epochs + 1):
         print('         Communication Round {}             '.format(comm_round))
+        t_round_ns = time.perf_counter_ns()
         # Sample Participating Devices
         num_devices = math.floor(len(clients) * device_participation)
         sampled_clients = random.sample(population=clients, k=num_devices)
@@ -122,14 +155,36 @@ def train_and_test_model(server: FedServer,
         else:
             raise NotImplementedError
 
+        tracer.record('round', t_round_ns, round=comm_round)
+
         # -------- Compute Metrics ---------- #
         if comm_round % verbose_freq == 0:
-            _ = evaluate_classifier(model=server.learner, train_loader=train_loader, test_loader=test_loader,
-                                    metrics=metrics, criterion=clients[0].criterion, device=device,
-                                    epoch=comm_round, num_epochs=global_epochs)
-
-
-def run_fed_train(config, metrics):
+            train_set, test_set = ('train', 'test') if comm_round == global_epochs \
+                else ('train_sample', 'test_sample')
+            with tracer.span('evaluation', background=evaluator is not None):
+                if evaluator is None:
+                    _ = evaluate_classifier(model=server.learner,
+                                            train_loader=eval_sets[train_set], test_loader=eval_sets[test_set],
+                                            metrics=metrics, criterion=clients[0].criterion, device=device,
+                                            epoch=comm_round, num_epochs=global_epochs)
+                else:
+                    evaluator.submit(model=server.learner, metrics=metrics, epoch=comm_round,
+                                     num_epochs=global_epochs, train_loader=train_set, test_loader=test_set)
+                    _ = evaluator.record(metrics=metrics)
+
+    if evaluator is not None:
+        evaluator.close(metrics=metrics)
+    if tracer is not NULL_TRACER:
+        tracer.print_summary()
+        metrics["trace_summary"] = tracer.summary()
+        if trace_config.get('trace_dir', None) is not None:
+            tracer.export_chrome_trace(path=os.path.join(trace_config['trace_dir'], 'trace.json'))
+
+
+def run_fed_train(config, metrics, seed=1):
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    random.seed(seed)
     pipeline = config.get('pipeline', 'default')
     data_config = config["data_config"]
     training_config = config["training_config"]
@@ -141,7 +196,7 @@ def run_fed_train(config, metrics):
     aggregation_config = training_config["aggregation_config"]
     compression_config = aggregation_config["compression_config"]
 
-    model = get_model(learner_config=learner_config, data_config=data_config)
+    model = get_model(learner_config=learner_config, data_config=data_config, seed=seed)
     gar = get_gar(aggregation_config=aggregation_config)
 
     print('# ------------------------------------------------- #')
@@ -160,7 +215,9 @@ def run_fed_train(config, metrics):
                        server_lrs=server_lrs,
                        gar=gar,
                        gar_config=aggregation_config,
-                       C=get_compression_operator(compression_config=compression_config))
+                       C=get_compression_operator(compression_config=compression_config),
+                       grad_attack_model=get_grad_attack(
+                           attack_config=aggregation_config.get("grad_attack_config", {"attack_model": None}), seed=seed))
     # *** Set up Client Nodes ****
     # -----------------------------
     clients = []
@@ -181,4 +238,5 @@ def run_fed_train(config, metrics):
                          data_config=data_config,
                          training_config=training_config,
                          metrics=metrics)
+    gar.close()
     return metrics
@@ -2,4 +2,6 @@ from .model_helper import *
 from .optimizers import *
 from .mlp import *
 from .cnn import *
+from .worker_pool import *
 
+from .async_evaluator import *
@@ -0,0 +1,96 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+from .model_helper import (flatten_params,
+                           dist_weights_to_model,
+                           use_flat_params,
+                           serialize_model,
+                           deserialize_model,
+                           compute_eval,
+                           record_eval)
+import torch
+import torch.multiprocessing as mp
+import traceback
+import queue
+from typing import Dict
+
+"""
+Runs evaluation in a background process so that training does not block on inference.
+The trainer submits flat weight snapshots tagged with the epoch ; results are recorded in metrics
+in submission order as they complete.
+"""
+
+
+class AsyncEvaluator:
+    def __init__(self, model, criterion, loaders: Dict, num_threads: int = 1, max_pending: int = 8):
+        """
+        loaders: name -> DataLoader / EvalSubset, submit refers to the loaders by name
+        max_pending: submit blocks (recording results) once these many evaluations are in flight
+        """
+        self.max_pending = max_pending
+        self.pending = []  # (epoch, num_epochs) of the submitted evaluations in order
+        self.train_loss = None  # most recent completed train loss
+
+        ctx = mp.get_context('spawn')
+        self.task_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.worker = ctx.Process(target=_eval_worker,
+                                  args=(serialize_model(learner=model), criterion, loaders, num_threads,
+                                        self.task_queue, self.result_queue),
+                                  daemon=True)
+        self.worker.start()
+
+    def submit(self, model, metrics: Dict, epoch, num_epochs, train_loader='train', test_loader='test',
+               train_metric=True, test_metric=True):
+        """ Queues the evaluation of a snapshot of the current weights of the model """
+        while len(self.pending) >= self.max_pending:
+            self._record(metrics=metrics, block=True)
+        self.task_queue.put((flatten_params(learner=model), train_loader, test_loader, train_metric, test_metric))
+        self.pending.append((epoch, num_epochs))
+
+    def record(self, metrics: Dict, block=False):
+        """
+        Records the completed results in metrics (all pending ones if block) ;
+        returns the most recent completed train loss (None if there is none yet)
+        """
+        while self.pending:
+            if not self._record(metrics=metrics, block=block):
+                break
+        return self.train_loss
+
+    def close(self, metrics: Dict):
+        """ Waits for the pending evaluations and shuts down the worker """
+        self.record(metrics=metrics, block=True)
+        self.task_queue.put(None)
+        self.worker.join()
+
+    def _record(self, metrics: Dict, block: bool) -> bool:
+        try:
+            status, result = self.result_queue.get(block=block)
+        except queue.Empty:
+            return False
+        if status is not None:
+            raise RuntimeError('Eval worker failed:\n{}'.format(status))
+        epoch, num_epochs = self.pending.pop(0)
+        train_loss = record_eval(result=result, metrics=metrics, epoch=epoch, num_epochs=num_epochs)
+        if "train_loss" in result:
+            self.train_loss = train_loss
+        return True
+
+
+def _eval_worker(model_bytes, criterion, loaders, num_threads, task_queue, result_queue):
+    torch.set_num_threads(num_threads)
+    model = use_flat_params(deserialize_model(model_bytes))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        try:
+            weights, train_loader, test_loader, train_metric, test_metric = task
+            dist_weights_to_model(weights=weights, learner=model)
+            result = compute_eval(model=model, train_loader=loaders[train_loader], test_loader=loaders[test_loader],
+                                  criterion=criterion, train_metric=train_metric, test_metric=test_metric)
+            result_queue.put((None, result))
+        except Exception:
+            result_queue.put((traceback.format_exc(), None))
@@ -7,6 +7,8 @@ from .vgg import *
 from .resnet import *
 import torch
 import functools
+import copy
+import io
 import numpy as np
 from typing import Dict
 
@@ -19,20 +21,136 @@ def zero_grad(learner):
             w.grad.zero_()
 
 
-def flatten_params(learner) -> np.ndarray:
-    """ Given a model flatten all params and return as np array """
-    flat_param = np.concatenate([w.data.cpu().numpy().flatten() for w in learner.parameters()])
+class FlatParams:
+    """
+    Re-homes all the params (and their grads) of a model as views into one contiguous buffer each.
+    Reading / writing the full flattened weights or grads is then a single copy instead of a concatenation.
+    Note: Build this after the model is moved to its device, moving it afterwards breaks the views.
+    """
+
+    def __init__(self, learner):
+        self.params = list(learner.parameters())
+        num_param = sum(w.numel() for w in self.params)
+
+        self.weights = torch.zeros(num_param, dtype=self.params[0].dtype, device=self.params[0].device)
+        self.grads = torch.zeros_like(self.weights)
+        self.grad_views = []
+
+        offset = 0
+        for w in self.params:
+            new_size = w.numel()
+            self.weights[offset:offset + new_size].copy_(w.data.view(-1))
+            w.data = self.weights[offset:offset + new_size].view_as(w)
+            grad_view = self.grads[offset:offset + new_size].view_as(w)
+            if w.grad is not None:
+                grad_view.copy_(w.grad)
+            w.grad = grad_view
+            self.grad_views.append(grad_view)
+            offset += new_size
+
+    def bind_grads(self, copy_grads=True):
+        """
+        optimizer.zero_grad() (set_to_none) or a grad assignment replaces the grad views,
+        point them back into the flat buffer (copying the current values if copy_grads)
+        """
+        for w, grad_view in zip(self.params, self.grad_views):
+            if w.grad is not None and w.grad.data_ptr() == grad_view.data_ptr():
+                continue
+            if copy_grads:
+                if w.grad is None:
+                    grad_view.zero_()
+                else:
+                    grad_view.copy_(w.grad)
+            w.grad = grad_view
+
+
+def use_flat_params(learner):
+    """ Opt-in: store all params / grads of the model in one contiguous buffer (see FlatParams) """
+    learner.flat_params = FlatParams(learner)
+    return learner
+
+
+def copy_model(learner):
+    """ Deepcopy of a model ; flat param storage (if used) is rebuilt for the copy """
+    flat_params = learner.__dict__.pop('flat_params', None)
+    replica = copy.deepcopy(learner)
+    if flat_params is not None:
+        learner.flat_params = flat_params
+        use_flat_params(learner=replica)
+    return replica
+
+
+def serialize_model(learner) -> bytes:
+    """ cpu copy of the model as bytes (ex. to ship it to another process) ; flat param storage is not kept """
+    replica = copy.deepcopy(learner).cpu()
+    replica.__dict__.pop('flat_params', None)
+    buffer = io.BytesIO()
+    torch.save(replica, buffer)
+    return buffer.getvalue()
+
+
+def deserialize_model(model_bytes: bytes):
+    return torch.load(io.BytesIO(model_bytes), weights_only=False)
+
+
+def _tensor_to_numpy(flat_tensor, out: np.ndarray = None) -> np.ndarray:
+    if out is None:
+        return flat_tensor.detach().to('cpu', copy=True).numpy()
+    out[:] = flat_tensor.detach().cpu().numpy()
+    return out
+
+
+def flatten_params(learner, out: np.ndarray = None) -> np.ndarray:
+    """ Given a model flatten all params and return as np array (written into out if supplied) """
+    flat_params = getattr(learner, 'flat_params', None)
+    if flat_params is not None:
+        return _tensor_to_numpy(flat_params.weights, out=out)
+    flat_param = np.concatenate([w.data.cpu().numpy().flatten() for w in learner.parameters()], out=out)
     return flat_param
 
 
-def flatten_grads(learner) -> np.ndarray:
-    """ Given a model flatten all params and return as np array """
-    flat_grad = np.concatenate([w.grad.data.cpu().numpy().flatten() for w in learner.parameters()])
+def flatten_grads(learner, out: np.ndarray = None) -> np.ndarray:
+    """ Given a model flatten all grads and return as np array (written into out if supplied) """
+    flat_params = getattr(learner, 'flat_params', None)
+    if flat_params is not None:
+        flat_params.bind_grads()
+        return _tensor_to_numpy(flat_params.grads, out=out)
+    flat_grad = np.concatenate([w.grad.data.cpu().numpy().flatten() for w in learner.parameters()], out=out)
     return flat_grad
 
 
+def has_batch_norm(learner) -> bool:
+    """ Returns True if the model has any BatchNorm layer (these keep running stats and can not be vmap-ed) """
+    return any(isinstance(m, torch.nn.modules.batchnorm._BatchNorm) for m in learner.modules())
+
+
+def flatten_batched_grads(learner, criterion, images, labels) -> np.ndarray:
+    """
+    Given a model and a stack of batches compute the flattened grad of every batch in a single vectorized pass.
+    images: (n, b, ...) labels: (n, b) ; returns (n, d) np array where row i is the grad computed on batch i
+    """
+    from torch.func import functional_call, grad, vmap
+
+    params = {name: w.detach() for name, w in learner.named_parameters()}
+    buffers = {name: b.detach() for name, b in learner.named_buffers()}
+
+    def batch_loss(_params, _buffers, x, y):
+        outputs = functional_call(learner, (_params, _buffers), (x,))
+        return criterion(outputs, y)
+
+    batched_grads = vmap(grad(batch_loss), in_dims=(None, None, 0, 0), randomness='different')(params, buffers,
+                                                                                                images, labels)
+    n = images.shape[0]
+    flat_grads = torch.cat([batched_grads[name].reshape(n, -1) for name in params], dim=1)
+    return flat_grads.cpu().numpy()
+
+
 def dist_weights_to_model(weights, learner):
     """ Given Weights and a model architecture this method updates the model parameters with the supplied weights """
+    flat_params = getattr(learner, 'flat_params', None)
+    if flat_params is not None:
+        flat_params.weights.copy_(torch.from_numpy(np.ascontiguousarray(weights)))
+        return
     parameters = learner.to('cpu').parameters()
     offset = 0
     for param in parameters:
@@ -45,6 +163,11 @@ def dist_weights_to_model(weights, learner):
 def dist_grads_to_model(grads, learner):
     """ Given Gradients and a model architecture this method updates the model gradients (Corresponding to each param)
     with the supplied grads """
+    flat_params = getattr(learner, 'flat_params', None)
+    if flat_params is not None:
+        flat_params.bind_grads(copy_grads=False)
+        flat_params.grads.copy_(torch.from_numpy(np.ascontiguousarray(grads)))
+        return
     parameters = learner.to('cpu').parameters()
     offset = 0
     for param in parameters:
@@ -98,24 +221,97 @@ def cycle(iterable):
             yield x
 
 
-def evaluate_classifier(epoch, num_epochs, model, train_loader, test_loader, metrics,
-                        criterion=None, device="cpu") -> float:
-    train_error, train_acc, train_loss = _evaluate(model=model, data_loader=train_loader,
-                                                   criterion=criterion, device=device)
-    test_error, test_acc, _ = _evaluate(model=model, data_loader=test_loader, device=device)
-
-    print('Epoch progress: {}/{}, train loss = {}, train acc = {}, test acc = {}'.
-          format(epoch, num_epochs, train_loss, train_acc, test_acc))
+class EvalSubset:
+    """
+    Fixed stratified random subset (sample_budget samples) of a dataset, materialized as tensors once so
+    that repeated (ex. per step) evaluations cost a fixed number of forward passes instead of a full pass.
+    Iterates like a DataLoader ; accuracy is estimated per class and weighted by the class frequencies.
+    """
+
+    def __init__(self, dataset, sample_budget: int, batch_size: int = 256, seed=1):
+        labels = _dataset_labels(dataset)
+        classes, class_counts = np.unique(labels, return_counts=True)
+        rng = np.random.default_rng(seed)
+
+        # proportional allocation (at least 1 sample per class)
+        sample_budget = min(sample_budget, len(labels))
+        class_budget = np.maximum(np.round(sample_budget * class_counts / len(labels)), 1).astype(int)
+        ix = np.concatenate([rng.choice(np.flatnonzero(labels == c), size=min(b, n), replace=False)
+                             for c, b, n in zip(classes, class_budget, class_counts)])
+
+        samples = [dataset[i] for i in ix]
+        self.images = torch.stack([x for x, _ in samples])
+        self.labels = torch.as_tensor([y for _, y in samples])
+        self.classes = torch.as_tensor(classes)
+        self.class_weights = class_counts / len(labels)
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        for i in range(0, len(self.labels), self.batch_size):
+            yield self.images[i:i + self.batch_size], self.labels[i:i + self.batch_size]
+
+    def accuracy(self, correct: torch.Tensor, z: float = 1.96):
+        """ correct: per sample 0/1 ; returns stratified accuracy estimate (%) and its CI half width (%) """
+        acc, var = 0, 0
+        for c, w in zip(self.classes, self.class_weights):
+            correct_c = correct[self.labels == c].double()
+            m = len(correct_c)
+            p = correct_c.mean().item()
+            acc += w * p
+            if m > 1:
+                var += w ** 2 * p * (1 - p) / (m - 1)
+        return float(100 * acc), float(100 * z * np.sqrt(var))
+
+
+def _dataset_labels(dataset) -> np.ndarray:
+    """ labels of a (possibly Subset of a) dataset without loading the samples when possible """
+    if isinstance(dataset, torch.utils.data.Subset):
+        return _dataset_labels(dataset.dataset)[np.asarray(dataset.indices)]
+    if hasattr(dataset, 'targets'):
+        return np.asarray(dataset.targets)
+    if isinstance(dataset, torch.utils.data.TensorDataset):
+        return dataset.tensors[1].numpy()
+    return np.asarray([y for _, y in dataset])
 
-    metrics["test_error"].append(test_error)
-    metrics["test_acc"].append(test_acc)
-    metrics["train_error"].append(train_error)
-    metrics["train_loss"].append(train_loss)
-    metrics["train_acc"].append(train_acc)
 
-    return train_loss
-
-    return 0
+def evaluate_classifier(epoch, num_epochs, model, train_loader, test_loader, metrics,
+                        criterion=None, device="cpu", train_metric=True, test_metric=True) -> float:
+    """
+    train / test loader can be an EvalSubset (sampled evaluation) - the CI half width of the accuracy is then
+    recorded in train_acc_ci / test_acc_ci (0 for full passes)
+    """
+    result = compute_eval(model=model, train_loader=train_loader, test_loader=test_loader, criterion=criterion,
+                          device=device, train_metric=train_metric, test_metric=test_metric)
+    return record_eval(result=result, metrics=metrics, epoch=epoch, num_epochs=num_epochs)
+
+
+def compute_eval(model, train_loader, test_loader, criterion=None, device="cpu",
+                 train_metric=True, test_metric=True) -> Dict:
+    """ Evaluates the model ; returns the metrics to record (see record_eval) """
+    result = {}
+    if train_metric:
+        result["train_error"], result["train_acc"], result["train_loss"], result["train_acc_ci"] = \
+            _evaluate(model=model, data_loader=train_loader, criterion=criterion, device=device)
+    if test_metric:
+        result["test_error"], result["test_acc"], _, result["test_acc_ci"] = \
+            _evaluate(model=model, data_loader=test_loader, device=device)
+    return result
+
+
+def record_eval(result: Dict, metrics: Dict, epoch, num_epochs) -> float:
+    """ Appends an evaluation result (see compute_eval) to metrics ; returns the train loss (0 if not evaluated) """
+    if "train_loss" in result:
+        print('Epoch progress: {}/{}, train loss = {}, train acc = {} (+/- {})'.
+              format(epoch, num_epochs, result["train_loss"], result["train_acc"], result["train_acc_ci"]))
+    if "test_acc" in result:
+        print('Epoch progress: {}/{}, test acc = {} (+/- {})'.
+              format(epoch, num_epochs, result["test_acc"], result["test_acc_ci"]))
+    for key, val in result.items():
+        metrics[key].append(val)
+    return result.get("train_loss", 0)
 
 
 def _evaluate(model, data_loader, verbose=False, criterion=None, device="cpu"):
@@ -125,6 +321,7 @@ def _evaluate(model, data_loader, verbose=False, criterion=None, device="cpu"):
         total = 0
         total_loss = 0
         batches = 0
+        all_correct = []
 
         for images, labels in data_loader:
             images = images.to(device)
@@ -138,9 +335,14 @@ def _evaluate(model, data_loader, verbose=False, criterion=None, device="cpu"):
             _, predicted = torch.max(outputs.data, 1)
             total += labels.size(0)
             correct += (predicted == labels).sum().item()
+            if isinstance(data_loader, EvalSubset):
+                all_correct.append((predicted == labels).cpu())
 
         acc = 100 * correct / total
+        acc_ci = 0
+        if isinstance(data_loader, EvalSubset):
+            acc, acc_ci = data_loader.accuracy(correct=torch.cat(all_correct))
         total_loss /= batches
         if verbose:
             print('Accuracy: {} %'.format(acc))
-        return 100 - acc, acc, total_loss
+        return 100 - acc, acc, total_loss, acc_ci
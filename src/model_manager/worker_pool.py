@@ -0,0 +1,95 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+from .model_helper import (flatten_params,
+                           flatten_grads,
+                           dist_weights_to_model,
+                           use_flat_params,
+                           serialize_model,
+                           deserialize_model)
+import torch
+import torch.multiprocessing as mp
+import traceback
+
+"""
+Simulates the workers of the distributed setting on a pool of CPU processes.
+Each process holds a replica of the model, reads the current weights from shared memory and
+writes its gradient row straight into the (shared memory) gradient matrix G.
+"""
+
+
+class GradWorkerPool:
+    def __init__(self, model, criterion, shared_arena: torch.Tensor, num_workers: int, seed=1):
+        """
+        shared_arena: (num_buffers x n x d) tensor in shared memory holding G (see GradMatrix)
+        """
+        self.num_workers = num_workers
+        # only G is stored in reduced precision - the workers always get the float32 weights
+        self.weights = torch.zeros(shared_arena.shape[-1], dtype=torch.float32).share_memory_()
+        self.version = 0
+
+        # serialize a cpu copy of the model so that each replica gets its own (non shared) params
+        model_bytes = serialize_model(learner=model)
+
+        ctx = mp.get_context('spawn')
+        self.task_queue = ctx.Queue()
+        self.done_queue = ctx.Queue()
+        self.workers = []
+        for rank in range(num_workers):
+            worker = ctx.Process(target=_grad_worker,
+                                 args=(rank, model_bytes, criterion, self.weights, shared_arena,
+                                       self.task_queue, self.done_queue, seed),
+                                 daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        print('Launched {} grad workers'.format(num_workers))
+
+    def compute_grads(self, model, round_images, round_labels, buffer_ix=0):
+        """ Computes grad of batch i on a worker and writes it in row i of buffer buffer_ix of the shared arena """
+        # publish current weights
+        flatten_params(learner=model, out=self.weights.numpy())
+        self.version += 1
+
+        for ix, (images, labels) in enumerate(zip(round_images, round_labels)):
+            self.task_queue.put((self.version, buffer_ix, ix, images, labels))
+
+        for _ in range(len(round_images)):
+            status = self.done_queue.get()
+            if status is not None:
+                raise RuntimeError('Grad worker failed:\n{}'.format(status))
+
+    def close(self):
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+
+def _grad_worker(rank, model_bytes, criterion, weights, shared_arena, task_queue, done_queue, seed):
+    # Each worker is single threaded - parallelism comes from the pool
+    torch.set_num_threads(1)
+    torch.manual_seed(seed + rank)
+
+    model = use_flat_params(deserialize_model(model_bytes))
+    model.train()
+    arena = shared_arena.numpy()
+    version = None
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        try:
+            task_version, buffer_ix, ix, images, labels = task
+            if task_version != version:
+                dist_weights_to_model(weights=weights.numpy(), learner=model)
+                version = task_version
+
+            model.zero_grad(set_to_none=False)
+            loss = criterion(model(images), labels)
+            loss.backward()
+            flatten_grads(learner=model, out=arena[buffer_ix, ix, :])
+            done_queue.put(None)
+        except Exception:
+            done_queue.put(traceback.format_exc())
@@ -0,0 +1,122 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict
+
+"""
+Lightweight tracing of the training pipeline stages with perf_counter_ns spans.
+Spans can be exported as a Chrome trace (chrome://tracing / Perfetto) and summarized per stage.
+NullTracer is used when tracing is off - its spans are no-ops.
+"""
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, **self.args)
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        # (name, thread id, start ns, duration ns, args)
+        self.events = []
+        self.t0 = time.perf_counter_ns()
+
+    def span(self, name: str, **args):
+        """ context manager timing the enclosed block as a span """
+        return _Span(self, name, args)
+
+    def record(self, name: str, start_ns: int, end_ns: int = None, **args):
+        """ record a span that started at start_ns (perf_counter_ns) and ends at end_ns (default: now) """
+        end_ns = time.perf_counter_ns() if end_ns is None else end_ns
+        self.events.append((name, threading.get_ident(), start_ns, end_ns - start_ns, args))
+
+    def summary(self) -> Dict:
+        """ stage -> count, total / mean / max time (ms) """
+        stats = {}
+        for name, _, _, dur, _ in self.events:
+            stat = stats.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stat["count"] += 1
+            stat["total_ms"] += dur / 1e6
+            stat["max_ms"] = max(stat["max_ms"], dur / 1e6)
+        for stat in stats.values():
+            stat["mean_ms"] = stat["total_ms"] / stat["count"]
+        return stats
+
+    def print_summary(self):
+        stats = self.summary()
+        print('{:<24} {:>8} {:>12} {:>10} {:>10}'.format('stage', 'count', 'total (ms)', 'mean (ms)', 'max (ms)'))
+        for name, stat in sorted(stats.items(), key=lambda item: -item[1]["total_ms"]):
+            print('{:<24} {:>8} {:>12.2f} {:>10.3f} {:>10.3f}'.format(name, stat["count"], stat["total_ms"],
+                                                                    stat["mean_ms"], stat["max_ms"]))
+
+    def export_chrome_trace(self, path: str):
+        """ writes the spans in the Chrome trace event format (complete events, times in us) """
+        pid = os.getpid()
+        trace_events = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                         "ts": (start - self.t0) / 1e3, "dur": dur / 1e3, "args": args}
+                        for name, tid, start, dur, args in self.events]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w+') as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+        print('Wrote trace to {}'.format(path))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTracer(Tracer):
+    _span = _NullSpan()
+
+    def span(self, name: str, **args):
+        return self._span
+
+    def record(self, name: str, start_ns: int, end_ns: int = None, **args):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+def get_tracer(trace_config: Dict) -> Tracer:
+    """ wrapper to return a Tracer if tracing is enabled else a (no-op) NullTracer """
+    if trace_config.get('enabled', False):
+        return Tracer()
+    return NULL_TRACER
+
+
+def traced(name: str):
+    """ method decorator - wraps the call in a span of self.tracer """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name):
+                return fn(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,2 +1,2 @@
-from base_trainer import TrainPipeline
-from sampling import SamplingPipeline
+from .base_trainer import TrainPipeline
+from .sampling import SamplingPipeline
@@ -1,2 +1,2 @@
-from base_trainer import TrainPipeline
+from .base_trainer import TrainPipeline
 
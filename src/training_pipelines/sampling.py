@@ -1,7 +1,7 @@
 from typing import Dict
 import numpy as np
 import torch
-from base_trainer import TrainPipeline
+from .base_trainer import TrainPipeline
 
 
 class SamplingPipeline(TrainPipeline):
@@ -0,0 +1,217 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import sqlite3
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+from numpyencoder import NumpyEncoder
+
+from optimization_driver import _run_seed
+
+"""
+Resumable sweep over a grid of config overrides.
+The grid (see configs/sweep_config.yaml) is expanded into a persistent job queue (sqlite) with one job per
+(config, seed), keyed by a hash of the config and seed. Jobs run on a local process pool ; jobs whose result
+already exists are skipped, so an interrupted sweep is continued by re-running the same command.
+"""
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Run a grid of experiments over the default config')
+    parser.add_argument('--conf',
+                        type=str,
+                        default='configs/sweep_config.yaml',
+                        help='Sweep config file path')
+    parser.add_argument('--retry_failed',
+                        action='store_true',
+                        help='Re-run the jobs that failed in previous runs of the sweep')
+    parser.add_argument('--dry_run',
+                        action='store_true',
+                        help='Only populate the job queue and print its status')
+    args = parser.parse_args()
+    return args
+
+
+def expand_grid(base_config, grid):
+    """ returns the list of (overrides, config) for every combination of the grid values """
+    keys = list(grid.keys())
+    jobs = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        overrides = dict(zip(keys, values))
+        config = copy.deepcopy(base_config)
+        for key, val in overrides.items():
+            set_key(config=config, key=key, val=val)
+        jobs.append((overrides, config))
+    return jobs
+
+
+def set_key(config, key: str, val):
+    """ set a (dot separated) nested key of the config """
+    *parents, leaf = key.split('.')
+    node = config
+    for parent in parents:
+        if parent not in node:
+            raise KeyError('{} is not a key of the config'.format(key))
+        node = node[parent]
+    node[leaf] = val
+
+
+def config_hash(config, seed=None) -> str:
+    content = json.dumps(config, sort_keys=True, cls=NumpyEncoder)
+    if seed is not None:
+        content += '/seed={}'.format(seed)
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+class JobQueue:
+    """ Persistent job queue - status of a job: pending / running / done / failed """
+
+    def __init__(self, db_path: str):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, config_key TEXT, seed INTEGER, '
+                        'overrides TEXT, config TEXT, status TEXT, error TEXT)')
+        self.db.commit()
+
+    def add(self, key, config_key, seed, overrides, config):
+        self.db.execute('INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, config_key, int(seed), json.dumps(overrides), json.dumps(config), 'pending', None))
+
+    def reset(self, from_status: str):
+        self.db.execute('UPDATE jobs SET status = ?, error = NULL WHERE status = ?', ('pending', from_status))
+        self.db.commit()
+
+    def set_status(self, key, status: str, error: str = None):
+        self.db.execute('UPDATE jobs SET status = ?, error = ? WHERE key = ?', (status, error, key))
+        self.db.commit()
+
+    def jobs(self, status: str = None):
+        query = 'SELECT key, config_key, seed, overrides, config, status FROM jobs'
+        rows = self.db.execute(query + ' WHERE status = ?', (status,)) if status else self.db.execute(query)
+        return [(key, config_key, seed, json.loads(overrides), json.loads(config), status)
+                for key, config_key, seed, overrides, config, status in rows]
+
+    def summary(self):
+        return dict(self.db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def commit(self):
+        self.db.commit()
+
+
+def _run_job(pipeline, train_mode, config, seed, num_threads, result_path):
+    metrics = _run_seed(pipeline=pipeline, train_mode=train_mode, config=config, seed=seed,
+                        num_threads=num_threads)
+    # never publish a result without training in it - the job would be skipped by every later run of the sweep
+    if not _has_training_metrics(metrics=metrics):
+        raise RuntimeError('Run finished without recording any training metrics')
+    _write_json(path=result_path, content=[metrics])
+
+
+def _has_training_metrics(metrics) -> bool:
+    return len(metrics.get('train_loss', [])) > 0
+
+
+def _is_complete_result(path) -> bool:
+    """ result file of a job exists and holds training metrics """
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        return all(_has_training_metrics(metrics=metrics) for metrics in json.load(f))
+
+
+def _write_json(path, content):
+    """ write then rename so that a result file only exists once complete """
+    with open(path + '.tmp', 'w+') as f:
+        json.dump(content, f, indent=4, ensure_ascii=False, cls=NumpyEncoder)
+    os.replace(path + '.tmp', path)
+
+
+def _merge_results(job_queue: JobQueue, result_dir: str):
+    """ for every config with all its seeds done write <config_key>.json holding the runs in seed order """
+    runs, index = {}, {}
+    for key, config_key, seed, overrides, _, status in job_queue.jobs():
+        runs.setdefault(config_key, []).append((seed, key, status))
+        index[config_key] = overrides
+    for config_key, seed_runs in runs.items():
+        if all(status == 'done' for _, _, status in seed_runs):
+            merged = []
+            for _, key, _ in sorted(seed_runs):
+                with open(os.path.join(result_dir, 'jobs', key + '.json')) as f:
+                    merged += json.load(f)
+            _write_json(path=os.path.join(result_dir, config_key + '.json'), content=merged)
+    _write_json(path=os.path.join(result_dir, 'index.json'), content=index)
+
+
+def run_sweep():
+    args = _parse_args()
+    sweep_config = yaml.load(open(args.conf), Loader=yaml.FullLoader)
+    base_config = yaml.load(open(sweep_config.get('base_config', 'configs/default_config.yaml')),
+                            Loader=yaml.FullLoader)
+
+    result_dir = sweep_config.get('result_dir', 'result_dumps/sweep/')
+    os.makedirs(os.path.join(result_dir, 'jobs'), exist_ok=True)
+    job_queue = JobQueue(db_path=os.path.join(result_dir, 'jobs.db'))
+
+    # ------- populate the job queue -------- #
+    seeds = sweep_config.get('seeds', [0])
+    for overrides, config in expand_grid(base_config=base_config, grid=sweep_config.get('grid', {})):
+        config_key = config_hash(config=config)
+        for seed in seeds:
+            job_queue.add(key=config_hash(config=config, seed=seed), config_key=config_key, seed=seed,
+                          overrides=overrides, config=config)
+    job_queue.commit()
+
+    # jobs left running by an interrupted sweep are run again (from their checkpoint if any)
+    job_queue.reset(from_status='running')
+    if args.retry_failed:
+        job_queue.reset(from_status='failed')
+    # skip jobs whose result exists
+    for key, *_ in job_queue.jobs(status='pending'):
+        if _is_complete_result(path=os.path.join(result_dir, 'jobs', key + '.json')):
+            job_queue.set_status(key=key, status='done')
+    print('Sweep jobs: {}'.format(job_queue.summary()))
+    if args.dry_run:
+        return
+
+    # ------- run the pending jobs -------- #
+    cores_per_job = sweep_config.get('cores_per_job', 1)
+    num_workers = sweep_config.get('num_workers', None) or max(1, os.cpu_count() // cores_per_job)
+    pipeline = sweep_config.get('pipeline', 'sampling')
+    train_mode = sweep_config.get('train_mode', 'distributed')
+
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn')) as executor:
+        futures = {}
+        for key, _, seed, _, config, _ in job_queue.jobs(status='pending'):
+            if sweep_config.get('checkpoint', False):
+                checkpoint_config = config["training_config"].setdefault("checkpoint_config", {})
+                checkpoint_config["checkpoint_dir"] = os.path.join(result_dir, 'checkpoints', key)
+                checkpoint_config["resume"] = True
+            future = executor.submit(_run_job, pipeline, train_mode, config, seed, cores_per_job,
+                                     os.path.join(result_dir, 'jobs', key + '.json'))
+            futures[future] = key
+            job_queue.set_status(key=key, status='running')
+
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                future.result()
+                job_queue.set_status(key=key, status='done')
+            except Exception:
+                error = traceback.format_exc()
+                print('Job {} failed:\n{}'.format(key, error))
+                job_queue.set_status(key=key, status='failed', error=error)
+            print('Sweep jobs: {}'.format(job_queue.summary()))
+
+    _merge_results(job_queue=job_queue, result_dir=result_dir)
+
+
+if __name__ == '__main__':
+    run_sweep()
@@ -0,0 +1,57 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import threading
+import numpy as np
+import pytest
+from scipy import stats
+
+from src.aggregation_manager.coordinate_wise import CoordinateWiseEngine
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 15, 16])
+def test_median_matches_numpy(n):
+    G = np.random.default_rng(n).standard_normal((n, 1000)).astype(np.float32)
+    engine = CoordinateWiseEngine(num_threads=2, block_size=96)
+    np.testing.assert_array_equal(engine.median(G=G), np.median(G, axis=0))
+
+
+@pytest.mark.parametrize('n, proportion', [(5, 0.4), (9, 0.45), (3, 0.34), (16, 0.3), (15, 0.3), (15, 0.0),
+                                           (1, 0.1)])
+def test_trimmed_mean_matches_scipy(n, proportion):
+    G = np.random.default_rng(n).standard_normal((n, 1000)).astype(np.float32)
+    engine = CoordinateWiseEngine(num_threads=2, block_size=96)
+    np.testing.assert_allclose(engine.trimmed_mean(G=G, proportion=proportion),
+                               stats.trim_mean(G, proportiontocut=proportion, axis=0), rtol=1e-6, atol=1e-6)
+
+
+def test_trimmed_mean_empty_slice_matches_scipy():
+    # (n = 4, proportion = 0.5) trims everything : scipy returns nan, it does not raise
+    G = np.random.default_rng(0).standard_normal((4, 10)).astype(np.float32)
+    with np.errstate(invalid='ignore'), pytest.warns(RuntimeWarning):
+        expected = stats.trim_mean(G, proportiontocut=0.5, axis=0)
+    with np.errstate(invalid='ignore'):
+        result = CoordinateWiseEngine(num_threads=1).trimmed_mean(G=G, proportion=0.5)
+    assert np.isnan(expected).all() and np.isnan(result).all()
+
+
+def test_trimmed_mean_rejects_crossing_cuts():
+    # (n = 10, proportion = 0.6) : lower cut 6 > upper cut 4
+    G = np.zeros((10, 10), dtype=np.float32)
+    with pytest.raises(ValueError):
+        stats.trim_mean(G, proportiontocut=0.6, axis=0)
+    with pytest.raises(ValueError):
+        CoordinateWiseEngine(num_threads=1).trimmed_mean(G=G, proportion=0.6)
+
+
+def test_close_releases_the_thread_pool():
+    G = np.random.default_rng(0).standard_normal((8, 1000)).astype(np.float32)
+    threads = threading.active_count()
+    engine = CoordinateWiseEngine(num_threads=4, block_size=64)
+    engine.median(G=G)
+    assert threading.active_count() > threads
+    engine.close()
+    assert threading.active_count() == threads
+    # still usable after close
+    np.testing.assert_array_equal(engine.median(G=G), np.median(G, axis=0))
+    engine.close()
@@ -0,0 +1,95 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import copy
+import os
+import numpy as np
+import pytest
+import torch
+import yaml
+from torch.utils.data import DataLoader, TensorDataset
+
+from optimization_driver import init_metric
+from src.distributed_trainer import train_and_test_model
+from src.model_manager import get_model, get_optimizer, get_scheduler, get_loss, flatten_params
+from src.aggregation_manager import get_gar
+from src.checkpoint_manager import Checkpointer
+
+
+def _train(train_config_overrides, seed=1, geo_med_config=None, checkpointer=None):
+    config = yaml.load(open('configs/default_config.yaml'), Loader=yaml.FullLoader)
+    train_config = config['training_config']
+    train_config.update({'global_epochs': 2, 'num_clients': 4})
+    train_config.update(train_config_overrides)
+    if geo_med_config is not None:
+        train_config['aggregation_config']['gar'] = 'geo_med'
+        train_config['aggregation_config']['geo_med_config'].update(geo_med_config)
+
+    torch.manual_seed(0)
+    dataset = TensorDataset(torch.randn(256, 1, 28, 28), torch.randint(0, 10, (256,)))
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    train_loader = DataLoader(dataset, batch_size=16, shuffle=True)
+    test_loader = DataLoader(dataset, batch_size=64)
+
+    model = get_model(learner_config=train_config['learner_config'], data_config=config['data_config'], seed=seed)
+    optimizer_config = train_config['optimizer_config']
+    optimizer = get_optimizer(params=model.parameters(),
+                              optimizer_config=optimizer_config['client_optimizer_config'])
+    lrs = get_scheduler(optimizer=optimizer, lrs_config=optimizer_config['client_lrs_config'])
+    metrics = init_metric(config=copy.deepcopy(config))
+    train_and_test_model(model=model, criterion=get_loss('ce'), optimizer=optimizer, lrs=lrs,
+                         gar=get_gar(aggregation_config=train_config['aggregation_config']),
+                         train_loader=train_loader, test_loader=test_loader, train_config=train_config,
+                         metrics=metrics, checkpointer=checkpointer)
+    return flatten_params(learner=model), metrics
+
+
+def test_pipelined_training_is_reproducible():
+    weights, metrics = _train({'pipeline_staleness': 2})
+    weights_rerun, metrics_rerun = _train({'pipeline_staleness': 2})
+    assert metrics['num_steps'] > 0
+    np.testing.assert_array_equal(weights, weights_rerun)
+    assert metrics['train_loss'] == metrics_rerun['train_loss']
+    assert metrics['test_acc'] == metrics_rerun['test_acc']
+
+
+# timings differ from run to run
+TIMING_METRICS = ('cost', 'time', 'gbps', 'saved', 'trace')
+
+RESUME_SETUPS = {
+    'plain': ({}, None),
+    'gm_warm_start': ({}, {'alg': 'stoch_wzfld', 'warm_start': True}),
+    'pipeline': ({'pipeline_staleness': 2}, None),
+    'vmap_fp16_gm_warm_start': ({'grad_engine': 'vmap', 'grad_storage_dtype': 'float16'},
+                                {'alg': 'vardi', 'warm_start': True}),
+}
+
+
+@pytest.mark.parametrize("setup", RESUME_SETUPS.keys())
+def test_resume_matches_uninterrupted_training(setup, tmp_path):
+    overrides, geo_med_config = RESUME_SETUPS[setup]
+    weights, metrics = _train(dict(overrides, global_epochs=2), geo_med_config=geo_med_config)
+
+    checkpoint_dir = str(tmp_path / 'ckpt')
+    _train(dict(overrides, global_epochs=1), geo_med_config=geo_med_config,
+           checkpointer=Checkpointer(checkpoint_dir=checkpoint_dir))
+    # another seed : only the restored state can make the run match
+    weights_resumed, metrics_resumed = _train(dict(overrides, global_epochs=2), seed=2, geo_med_config=geo_med_config,
+                                              checkpointer=Checkpointer(checkpoint_dir=checkpoint_dir, resume=True))
+
+    np.testing.assert_array_equal(weights, weights_resumed)
+    for key, val in metrics.items():
+        if key != 'config' and not any(tag in key for tag in TIMING_METRICS):
+            assert metrics_resumed[key] == val, key
+
+
+def test_only_the_last_checkpoints_are_kept(tmp_path):
+    checkpoint_dir = str(tmp_path / 'ckpt')
+    _train({'global_epochs': 2}, checkpointer=Checkpointer(checkpoint_dir=checkpoint_dir, keep=2))
+    assert sorted(os.listdir(checkpoint_dir)) == ['ckpt_1', 'ckpt_2', 'latest']
+    # the checkpoints of the previous run stay in the rotation
+    _train({'global_epochs': 4}, checkpointer=Checkpointer(checkpoint_dir=checkpoint_dir, resume=True, keep=2))
+    assert sorted(os.listdir(checkpoint_dir)) == ['ckpt_3', 'ckpt_4', 'latest']
+    with open(os.path.join(checkpoint_dir, 'latest')) as f:
+        assert f.read() == 'ckpt_4'
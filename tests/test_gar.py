@@ -0,0 +1,33 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import tracemalloc
+import numpy as np
+import pytest
+
+from src.aggregation_manager import get_gar
+
+
+def test_gather_columns_rejects_out_of_range_indices():
+    gar = get_gar(aggregation_config={'gar': 'mean'})
+    G = np.zeros((4, 10), dtype=np.float32)
+    for ix in ([0, 10], [-1, 3]):
+        with pytest.raises(IndexError):
+            gar.gather_columns(G=G, ix=ix)
+
+
+def test_gather_columns_reuses_its_buffer():
+    gar = get_gar(aggregation_config={'gar': 'mean'})
+    rng = np.random.default_rng(0)
+    G = rng.standard_normal((32, 100000), dtype=np.float32)
+    ix = np.sort(rng.choice(G.shape[1], 40000, replace=False))
+
+    gathered = gar.gather_columns(G=G, ix=ix)
+    np.testing.assert_array_equal(gathered, G[:, ix])
+    tracemalloc.start()
+    for _ in range(3):
+        assert gar.gather_columns(G=G, ix=ix) is gathered
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # a copy of G[:, ix] would be 32 x 40000 x 4 bytes = 5.1 MB
+    assert peak < 0.1 * gathered.nbytes
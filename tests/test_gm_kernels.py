@@ -0,0 +1,59 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import numpy as np
+import pytest
+
+from src.aggregation_manager.gm_kernels import (GMKernel,
+                                                vardi,
+                                                weiszfeld,
+                                                accelerated_weiszfeld,
+                                                smoothed_weiszfeld,
+                                                stochastic_weiszfeld)
+
+# relative l2 distance to the float64 reference median : the float32 kernels land at ~1e-7
+TOL = 1e-5
+
+SOLVERS = {'vardi': vardi,
+           'wzfld': weiszfeld,
+           'accel_wzfld': accelerated_weiszfeld,
+           'smooth_wzfld': smoothed_weiszfeld,
+           'stoch_wzfld': stochastic_weiszfeld}
+
+
+def _make_G(kind: str, n: int = 33, d: int = 2000, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    G = rng.standard_normal((n, d)) * rng.uniform(0.5, 2, (n, 1)) + rng.standard_normal(d)
+    if kind == 'outliers':
+        # a third of the rows far away from the rest
+        G[:n // 3] = 20 * rng.standard_normal((n // 3, d)) + 10
+    return G.astype(np.float32)
+
+
+def _reference_median(G: np.ndarray) -> np.ndarray:
+    gm, _ = weiszfeld(X=G.astype(np.float64), eps=1e-12, max_iter=5000)
+    return gm.copy()
+
+
+@pytest.mark.parametrize('kind', ['random', 'outliers'])
+@pytest.mark.parametrize('alg', list(SOLVERS))
+def test_solver_matches_float64_reference(alg, kind):
+    G = _make_G(kind=kind)
+    ref = _reference_median(G)
+    solver = SOLVERS[alg]
+    kwargs = {'rng': np.random.default_rng(0)} if alg == 'stoch_wzfld' else {}
+    kernel = GMKernel()
+    # second solve reuses the kernel buffers
+    for _ in range(2):
+        gm, num_iter = solver(X=G, eps=1e-5, max_iter=1000, kernel=kernel, **kwargs)
+        assert num_iter < 1000
+        assert gm.dtype == np.float32
+        assert np.linalg.norm(gm - ref) / np.linalg.norm(ref) < TOL
+
+
+def test_float16_storage_matches_float32():
+    G = _make_G(kind='outliers')
+    ref = _reference_median(G.astype(np.float16).astype(np.float32))
+    gm, _ = weiszfeld(X=G.astype(np.float16), eps=1e-5, max_iter=1000)
+    assert gm.dtype == np.float32
+    assert np.linalg.norm(gm - ref) / np.linalg.norm(ref) < TOL
@@ -0,0 +1,130 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+from src.attack_manager import get_grad_attack
+
+NOISE_CONFIGS = {
+    'gaussian': {"noise_dist": 'gaussian', "attack_std": 2, "mean_shift": 0.5},
+    'uniform': {"noise_dist": 'uniform', "noise_range": [-3, 1]},
+}
+
+
+def _make_G(n: int = 20, d: int = 3000, dtype=np.float32, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((n, d)) + 1).astype(dtype)
+
+
+def _row_noise(rng, d, conf):
+    """ noise of one row, drawn as the per row implementation did """
+    if conf["noise_dist"] == 'gaussian':
+        return rng.standard_normal(size=d, dtype=np.float32) * conf["attack_std"]
+    lo, hi = conf["noise_range"]
+    return rng.random(size=d, dtype=np.float32) * (hi - lo) + lo
+
+
+def _loop_attack(G: np.ndarray, attack_config, seed):
+    """ per row reference : the byzantine rows are drawn first, then each row is corrupted in turn """
+    G = G.copy()
+    rng = np.random.default_rng(seed)
+    frac = attack_config["frac_adv"]
+    byz = np.flatnonzero(rng.random(G.shape[0]) < frac)[:int(frac * G.shape[0])]
+    d = G.shape[1]
+    for i in byz:
+        g = G[i].astype(np.float32)
+        if attack_config["attack_model"] == 'additive':
+            conf = attack_config["rand_additive_attack_conf"]
+            if conf["noise_dist"] == 'gaussian':
+                g = g * np.float32(1 + conf["mean_shift"])
+            g = g + _row_noise(rng, d, conf)
+        elif attack_config["attack_model"] == 'random':
+            conf = attack_config["rand_additive_attack_conf"]
+            noise = _row_noise(rng, d, conf)
+            g = noise + g * conf["mean_shift"] if conf["noise_dist"] == 'gaussian' else noise
+        elif attack_config["attack_model"] == 'bit_flip':
+            g = - attack_config["sign_flip_conf"]["flip_scale"] * g
+        elif attack_config["attack_model"] == 'random_sign_flip':
+            flip = rng.random(size=d, dtype=np.float32) < attack_config["sign_flip_conf"]["flip_prob"]
+            g = np.where(flip, -g, g)
+        G[i] = g
+    return G, byz
+
+
+ROW_ATTACKS = [
+    {"attack_model": 'additive', "rand_additive_attack_conf": NOISE_CONFIGS['gaussian']},
+    {"attack_model": 'additive', "rand_additive_attack_conf": NOISE_CONFIGS['uniform']},
+    {"attack_model": 'random', "rand_additive_attack_conf": NOISE_CONFIGS['gaussian']},
+    {"attack_model": 'random', "rand_additive_attack_conf": NOISE_CONFIGS['uniform']},
+    {"attack_model": 'bit_flip', "sign_flip_conf": {"flip_scale": 3}},
+    {"attack_model": 'random_sign_flip', "sign_flip_conf": {"flip_prob": 0.3}},
+]
+
+
+@pytest.mark.parametrize("attack_config", ROW_ATTACKS,
+                         ids=lambda c: '-'.join([c["attack_model"]] +
+                                                [c.get("rand_additive_attack_conf", {}).get("noise_dist", '')]))
+def test_vectorized_attack_matches_per_row_loop(attack_config):
+    attack_config = dict(attack_config, frac_adv=0.3)
+    G = _make_G()
+    expected, byz = _loop_attack(G=G, attack_config=attack_config, seed=7)
+    assert len(byz) > 0
+
+    out = get_grad_attack(attack_config=attack_config, seed=7).launch_attack(G=G)
+    np.testing.assert_allclose(out, expected, rtol=1e-6, atol=1e-6)
+    honest = np.setdiff1d(np.arange(G.shape[0]), byz)
+    np.testing.assert_array_equal(out[honest], _make_G()[honest])
+
+
+@pytest.mark.parametrize("attack_config", ROW_ATTACKS + [{"attack_model": 'drift'}, {"attack_model": 'ipm'}],
+                         ids=lambda c: '-'.join([c["attack_model"]] +
+                                                [c.get("rand_additive_attack_conf", {}).get("noise_dist", '')]))
+def test_attack_keeps_float16_grads(attack_config):
+    attack_config = dict(attack_config, frac_adv=0.3)
+    G = _make_G(dtype=np.float16)
+    out = get_grad_attack(attack_config=attack_config, seed=7).launch_attack(G=G)
+    assert out is G
+    assert out.dtype == np.float16
+    assert np.isfinite(out).all()
+    assert not np.array_equal(out, _make_G(dtype=np.float16))
+
+
+def _honest_stats(G: np.ndarray, byz: np.ndarray):
+    honest = np.delete(G, byz, axis=0).astype(np.float64)
+    return honest.mean(axis=0), honest.std(axis=0)
+
+
+@pytest.mark.parametrize("n, frac_adv", [(20, 0.2), (25, 0.3), (10, 0.1)])
+def test_drift_uses_z_max(n, frac_adv):
+    f = int(frac_adv * n)
+    s = np.floor(n / 2 + 1) - f
+    z = norm.ppf((n - s) / n)
+    attack = get_grad_attack(attack_config={"attack_model": 'drift', "frac_adv": frac_adv, "chunk_size": 700}, seed=3)
+    assert attack.z_max(n=n, num_byz=f) == pytest.approx(z)
+
+    G = _make_G(n=n)
+    byz = np.sort(np.random.default_rng(3).choice(n, size=f, replace=False))
+    mu, sigma = _honest_stats(G, byz)
+    out = attack.launch_attack(G=G.copy())
+    np.testing.assert_allclose(out[byz], np.tile(mu - z * sigma, (f, 1)), rtol=1e-4, atol=1e-5)
+    np.testing.assert_array_equal(np.delete(out, byz, axis=0), np.delete(G, byz, axis=0))
+
+
+def test_drift_fixed_n_std_and_ipm():
+    n, frac_adv = 20, 0.25
+    f = int(frac_adv * n)
+    G = _make_G(n=n)
+    byz = np.sort(np.random.default_rng(3).choice(n, size=f, replace=False))
+    mu, sigma = _honest_stats(G, byz)
+
+    drift = get_grad_attack(attack_config={"attack_model": 'drift', "frac_adv": frac_adv, "attack_n_std": 1.5,
+                                           "chunk_size": 512}, seed=3)
+    out = drift.launch_attack(G=G.copy())
+    np.testing.assert_allclose(out[byz], np.tile(mu - 1.5 * sigma, (f, 1)), rtol=1e-4, atol=1e-5)
+
+    ipm = get_grad_attack(attack_config={"attack_model": 'ipm', "frac_adv": frac_adv, "ipm_epsilon": 0.5,
+                                         "chunk_size": 512}, seed=3)
+    out = ipm.launch_attack(G=G.copy())
+    np.testing.assert_allclose(out[byz], np.tile(-0.5 * mu, (f, 1)), rtol=1e-4, atol=1e-5)
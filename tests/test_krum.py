@@ -0,0 +1,53 @@
+# Copyright (c) Anish Acharya.
+# Licensed under the MIT License
+
+import numpy as np
+import pytest
+
+from src.aggregation_manager import get_gar
+
+
+def _loop_krum(G: np.ndarray, krum_frac: float, multi_krum_m: int):
+    """ O(n^2) reference : pairwise distances, score_i = sum of the m smallest distances of g_i (self included) """
+    n = G.shape[0]
+    dist = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i):
+            dist[i, j] = dist[j, i] = np.linalg.norm(G[i].astype(np.float64) - G[j])
+    m = int(krum_frac * n)
+    scores = [sum(np.sort(dist[i])[:m]) for i in range(n)]
+    selected = sorted(np.argsort(scores, kind='stable')[:multi_krum_m])
+    return selected, G[selected].astype(np.float64).mean(axis=0)
+
+
+def _make_G(n: int, d: int = 5000, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    G = rng.standard_normal((n, d)) * rng.uniform(0.5, 2, (n, 1)) + 5
+    # a few Byzantine rows
+    G[:max(1, n // 5)] += 3 * rng.standard_normal((max(1, n // 5), d))
+    return G.astype(np.float32)
+
+
+# (n = 5, krum_frac = 0.4) : m = 2 - each score is the distance to the single nearest neighbour (n - f - 2 = 1, f = 2)
+@pytest.mark.parametrize('n, krum_frac', [(16, 0.3), (32, 0.5), (5, 0.4)])
+@pytest.mark.parametrize('multi_krum_m', [1, 4])
+def test_krum_matches_pairwise_loop(n, krum_frac, multi_krum_m):
+    G = _make_G(n=n)
+    gar = get_gar(aggregation_config={'gar': 'krum',
+                                      'krum_config': {'krum_frac': krum_frac, 'multi_krum_m': multi_krum_m}})
+    selected, expected = _loop_krum(G=G, krum_frac=krum_frac, multi_krum_m=multi_krum_m)
+    agg = gar.aggregate(G=G)
+    if multi_krum_m == 1:
+        # Krum returns the selected grad itself
+        assert [i for i in range(n) if np.array_equal(G[i], agg)] == selected
+    np.testing.assert_allclose(agg, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_krum_on_a_block_matches_pairwise_loop():
+    G = _make_G(n=16)
+    ix = np.sort(np.random.default_rng(1).choice(G.shape[1], 500, replace=False))
+    gar = get_gar(aggregation_config={'gar': 'krum', 'krum_config': {'krum_frac': 0.3, 'multi_krum_m': 4}})
+    _, expected = _loop_krum(G=G[:, ix], krum_frac=0.3, multi_krum_m=4)
+    agg = gar.aggregate(G=G, ix=ix)
+    np.testing.assert_allclose(agg[ix], expected, rtol=1e-5, atol=1e-5)
+    assert np.count_nonzero(np.delete(agg, ix)) == 0